@@ -36,7 +36,7 @@ from usb.device.midi_multi_2 import MidiMulti
 import time
 
 _NUM_PORTS    = const(3) # Set up 3 MIDI IN/OUT ports
-_PORT_NAMES   = ['Port A', 'Port B', 'Port C'] # Port names need to be longer than one character (needs to be of type List)
+_PORT_NAMES   = ['Port A', 'Port B', 'Port C'] # Port names need to be longer than one character (list or tuple)
 _MANUFACTURER = 'TestMaker'
 _PRODUCT      = 'TestMIDI'
 _SERIAL       = machine.unique_id()
@@ -45,6 +45,40 @@ _SERIAL       = machine.unique_id()
 channel = 0
 note = 60
 
+# Handlers for received MIDI 1.0 Channel Voice Messages, called with (group, byte_0, byte_1, byte_2)
+
+def _rx_note_off(group, byte_0, byte_1, byte_2):
+    print('RX Note Off on port', group, 'channel', byte_0 & 0x0F, 'note', byte_1, 'velocity', byte_2)
+
+def _rx_note_on(group, byte_0, byte_1, byte_2):
+    global note
+    if byte_2 == 0: # Note On with velocity 0 is a Note Off
+        _rx_note_off(group, byte_0, byte_1, byte_2)
+        return
+    print('RX Note On on port', group, 'channel', byte_0 & 0x0F, 'note', byte_1, 'velocity', byte_2)
+    note = byte_1
+
+def _rx_control_change(group, byte_0, byte_1, byte_2):
+    print('RX CC on port', group, 'channel', byte_0 & 0x0F, 'ctrl', byte_1, 'value', byte_2)
+
+def _rx_other(group, byte_0, byte_1, byte_2):
+    print('RX MIDI message on port', group, 'bytes', byte_0, byte_1, byte_2)
+
+# Handler per status byte high nibble (0x8 = Note Off, 0x9 = Note On, 0xB = Control Change; None = _rx_other)
+_RX_HANDLERS = (None, None, None, None, None, None, None, None, _rx_note_off, _rx_note_on, None, _rx_control_change, None, None, None, None)
+
+# Handlers per UMP Message Type, called with (group, ump_bytes)
+
+def _rx_midi_1_channel_voice(group, ump_bytes):
+    global channel
+    channel = (byte_0 := ump_bytes[1]) & 0x0F
+    (_RX_HANDLERS[byte_0 >> 4] or _rx_other)(group, byte_0, ump_bytes[2], ump_bytes[3])
+
+# Handler per Message Type (upper 4 bits of the first UMP byte; 0x2 = MIDI 1.0 Channel Voice Messages); None = ignored by this example,
+# like Utility Messages (0x0), System Real Time and System Common Messages (0x1), Data Messages (0x3) and MIDI 2.0 Channel Voice Messages
+# (0x4, not supported in MIDI 1.0 Protocol mode); the UMP size matching the Message Type is guaranteed by MidiMulti
+_UMP_HANDLERS = (None, None, _rx_midi_1_channel_voice, None, None, None, None, None, None, None, None, None, None, None, None, None)
+
 class MIDIExample(MidiMulti):
 
     def __init__(self, num_ports=1, port_names=None):
@@ -56,29 +90,8 @@ class MIDIExample(MidiMulti):
 
     def _print_midi_in(self, ump_bytes):
         '''Example callback function which is called each time a MIDI message is received'''
-        global channel, note
-        group = (b_0 := ump_bytes[0]) & 0xF0
-        message_type = b_0 & 0xF0
-        if message_type == 0x0 and len(ump_bytes) == 4: # Utility Messages
-            pass
-        elif message_type == 0x1 and len(ump_bytes) == 4: # System Real Time Messages / System Common Messages
-            pass
-        elif message_type == 0x2 and len(ump_bytes) == 4: # MIDI 1.0 Channel Voice Messages
-            command = (byte_0 := ump_bytes[1]) & 0xF0
-            channel = byte_0 & 0x0F
-            if command == 0x90 and ump_bytes[3] != 0: # Note On
-                print(f'RX Note On on port {group}: channel {channel} note {ump_bytes[2]} velocity {ump_bytes[3]}')
-                note = ump_bytes[2]
-            elif command == 0x80 or (command == 0x90 and ump_bytes[3] == 0): # Note Off
-                print(f'RX Note Off on port {group}: channel {channel} note {ump_bytes[2]} velocity {ump_bytes[3]}')
-            elif command == 0xB0: # Control Change
-                print(f'RX CC on port {group}: channel {channel} ctrl {ump_bytes[2]} value {ump_bytes[3]}')
-            else:
-                print(f'RX MIDI message on port {group}: {byte_0}, {ump_bytes[2]}, {ump_bytes[3]}')
-        elif message_type == 0x3 and len(ump_bytes) == 8: # Data Messages (including System Exclusive)
-            pass
-        # elif message_type == 0x4 and len(ump_bytes) == 8: # MIDI 2.0 Channel Voice Messages (not supported in MIDI 1.0 Protocol mode)
-        #     pass
+        if (handler := _UMP_HANDLERS[(b_0 := ump_bytes[0]) >> 4]) is not None:
+            handler(b_0 & 0x0F, ump_bytes) # Group is in the lower 4 bits of the first byte
 
 # For when using VSCode: delay to allow the REPL to connect before main.py is ran
 time.sleep_ms(1000)
@@ -91,20 +104,22 @@ usb.device.get().init(m, builtin_driver=False, manufacturer_str=_MANUFACTURER, p
                       device_class=0xEF, device_subclass=2, device_protocol=1)
 print('Waiting for USB host to configure the interface...')
 while not m.is_open():
-    time.sleep_ms(100)
+    machine.idle() # Sleep until the next interrupt (on_open is called from the USB interrupt handling), instead of polling every 100 ms
 print('Starting MIDI loop...')
 _CONTROLLER = const(64)
 control_val = 0
-while m.is_open():
+# Bind the methods used in the loop once, instead of looking them up on each call
+note_on, note_off, control_change, is_open, sleep = m.note_on, m.note_off, m.control_change, m.is_open, time.sleep
+while is_open():
     for i, port in enumerate(range(_NUM_PORTS)):
         print(f'TX Note On on port {port}: channel {channel} note {note + i}')
-        m.note_on(port, channel, note + i) # Velocity is an optional third argument
-        time.sleep(0.5)
+        note_on(port, channel, note + i) # Velocity is an optional third argument
+        sleep(0.5)
         print(f'TX Note Off on port {port}: channel {channel} note {note + i}')
-        m.note_off(port, channel, note + i)
-        time.sleep(1)
+        note_off(port, channel, note + i)
+        sleep(1)
         print(f'TX CC on port {port}: channel {channel} ctrl {_CONTROLLER} value {control_val}')
-        m.control_change(port, channel, _CONTROLLER, control_val)
+        control_change(port, channel, _CONTROLLER, control_val)
         control_val = (control_val + 1) & 0x7F
-        time.sleep(1)
+        sleep(1)
 print('USB host has reset device, example done')
\ No newline at end of file
@@ -37,7 +37,7 @@ import time
 
 _NUM_IN       = const(3) # Set up 3 MIDI IN ports
 _NUM_OUT      = const(3) # and 3 MIDI OUT ports (only _NUM_IN == _NUM_OUT works for Windows)
-_PORT_NAMES   = ['Port A', 'Port B', 'Port C'] # Port names need to be longer than one character (needs to be of type List)
+_PORT_NAMES   = ['Port A', 'Port B', 'Port C'] # Port names need to be longer than one character (list or tuple)
 _MANUFACTURER = 'TestMaker'
 _PRODUCT      = 'TestMIDI'
 _SERIAL       = machine.unique_id()
@@ -46,6 +46,28 @@ _SERIAL       = machine.unique_id()
 channel = 0
 note = 60
 
+# Handlers for received MIDI messages, called with (cable, byte_0, byte_1, byte_2)
+
+def _rx_note_off(cable, byte_0, byte_1, byte_2):
+    print('RX Note Off on port', cable, 'channel', byte_0 & 0x0F, 'note', byte_1, 'velocity', byte_2)
+
+def _rx_note_on(cable, byte_0, byte_1, byte_2):
+    global note
+    if byte_2 == 0: # Note On with velocity 0 is a Note Off
+        _rx_note_off(cable, byte_0, byte_1, byte_2)
+        return
+    print('RX Note On on port', cable, 'channel', byte_0 & 0x0F, 'note', byte_1, 'velocity', byte_2)
+    note = byte_1
+
+def _rx_control_change(cable, byte_0, byte_1, byte_2):
+    print('RX CC on port', cable, 'channel', byte_0 & 0x0F, 'ctrl', byte_1, 'value', byte_2)
+
+def _rx_other(cable, byte_0, byte_1, byte_2):
+    print('RX MIDI message on port', cable, 'bytes', byte_0, byte_1, byte_2)
+
+# Handler per status byte high nibble (0x8 = Note Off, 0x9 = Note On, 0xB = Control Change; None = _rx_other)
+_RX_HANDLERS = (None, None, None, None, None, None, None, None, _rx_note_off, _rx_note_on, None, _rx_control_change, None, None, None, None)
+
 class MidiExample(MidiMulti):
 
     def __init__(self, num_in=1, num_out=1, port_names=None):
@@ -55,21 +77,11 @@ class MidiExample(MidiMulti):
         super().on_open()
         print('Device opened by host')
 
-    def _print_midi_in(self, cable, data_packet):
+    def _print_midi_in(self, cable, cin, byte_0, byte_1, byte_2):
         '''Example callback function which is called each time a MIDI message is received'''
-        global channel, note
-        # cin = data_packet[0] & 0x0F
-        command = (byte_0 := data_packet[1]) & 0xF0
+        global channel
         channel = byte_0 & 0x0F
-        if command == 0x90 and data_packet[3] != 0: # Note On
-            print(f'RX Note On on port {cable}: channel {channel} note {data_packet[2]} velocity {data_packet[3]}')
-            note = data_packet[2]
-        elif command == 0x80 or (command == 0x90 and data_packet[3] == 0): # Note Off
-            print(f'RX Note Off on port {cable}: channel {channel} note {data_packet[2]} velocity {data_packet[3]}')
-        elif command == 0xB0: # Control Change
-            print(f'RX CC on port {cable}: channel {channel} ctrl {data_packet[2]} value {data_packet[3]}')
-        else:
-            print(f'RX MIDI message on port {cable}: {byte_0}, {data_packet[2]}, {data_packet[3]}')
+        (_RX_HANDLERS[byte_0 >> 4] or _rx_other)(cable, byte_0, byte_1, byte_2)
 
 # For when using VSCode: delay to allow the REPL to connect before main.py is ran
 time.sleep_ms(1000)
@@ -82,20 +94,27 @@ usb.device.get().init(m, builtin_driver=False, manufacturer_str=_MANUFACTURER, p
                       device_class=0xEF, device_subclass=2, device_protocol=1)
 print('Waiting for USB host to configure the interface...')
 while not m.is_open():
-    time.sleep_ms(100)
+    machine.idle() # Sleep until the next interrupt (on_open is called from the USB interrupt handling), instead of polling every 100 ms
 print('Starting MIDI loop...')
 _CONTROLLER = const(64)
 control_val = 0
-while m.is_open():
+# Prebuilt Control Change MIDI Event Packet for each cable, of which only the channel and value are updated before sending
+cc_packets = [bytearray(((cable << 4) | 0xB, 0xB0, _CONTROLLER, 0)) for cable in range(_NUM_OUT)]
+# Bind the methods used in the loop once, instead of looking them up on each call
+note_on, note_off, send_packet, is_open, sleep = m.note_on, m.note_off, m.send_packet, m.is_open, time.sleep
+while is_open():
     for i, cable in enumerate(range(_NUM_OUT)):
         print(f'TX Note On on port {cable}: channel {channel} note {note + i}')
-        m.note_on(cable, channel, note + i) # Velocity is an optional third argument
-        time.sleep(0.5)
+        note_on(cable, channel, note + i) # Velocity is an optional third argument
+        sleep(0.5)
         print(f'TX Note Off on port {cable}: channel {channel} note {note + i}')
-        m.note_off(cable, channel, note + i)
-        time.sleep(1)
+        note_off(cable, channel, note + i)
+        sleep(1)
         print(f'TX CC on port {cable}: channel {channel} ctrl {_CONTROLLER} value {control_val}')
-        m.control_change(cable, channel, _CONTROLLER, control_val)
+        packet = cc_packets[cable]
+        packet[1] = 0xB0 | channel
+        packet[3] = control_val
+        send_packet(packet)
         control_val = (control_val + 1) & 0x7F
-        time.sleep(1)
+        sleep(1)
 print('USB host has reset device, example done')
\ No newline at end of file
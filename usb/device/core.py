@@ -61,6 +61,10 @@ _USB_STR_SERIAL = const(0x03)
 # Error constant to match mperrno.h
 _MP_EINVAL = const(22)
 
+# Set to 1 to print the configuration descriptor (and pause) each time the device is configured; with 0 the
+# compiler drops that code entirely
+_DEBUG = const(0)
+
 _dev = None  # Singleton _Device instance
 
 
@@ -238,14 +242,14 @@ class _Device:
             max_power_ma,
         )
 
-######
-        if desc.b:
-            print("Config descriptor header:", list(desc.b[:9]))
-            print("Descriptor length:", desc.o)
-            print("Descriptor hex:", desc.b[:desc.o].hex())
-            print("Descriptor bytes:", list(desc.b[:desc.o]))
-            print('strs', strs)
-            time.sleep_ms(1000)
+        if _DEBUG:
+            if desc.b:
+                print("Config descriptor header:", list(desc.b[:9]))
+                print("Descriptor length:", desc.o)
+                print("Descriptor hex:", desc.b[:desc.o].hex())
+                print("Descriptor bytes:", list(desc.b[:desc.o]))
+                print('strs', strs)
+                time.sleep_ms(1000)
 
         _usbd.config(
             desc_dev,
@@ -870,6 +874,21 @@ class Buffer:
             self.finish_write(to_w)
         return to_w
 
+    def write_4(self, b0, b1, b2, b3):
+        # Helper method for the producer to write 4 bytes (e.g. a USB MIDI
+        # Event Packet) in one call, without allocating the memoryview that
+        # pend_write() returns. Returns False if less than 4 bytes are writable.
+        if self._l - self._n < 4:
+            return False
+        self._w = (_w := self._n)
+        _b = self._b
+        _b[_w] = b0
+        _b[_w + 1] = b1
+        _b[_w + 2] = b2
+        _b[_w + 3] = b3
+        self.finish_write(4)
+        return True
+
     def pend_read(self):
         # Return a memoryview slice that the consumer can read bytes from
         return self._b[: self._n]
@@ -26,49 +26,111 @@
     CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
     SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.'''
 
+import micropython
 from micropython import schedule
+from struct import pack_into
 from usb.device.core import Interface, Buffer
 
-_BUFFER_SIZE        = const(64)
 _EP_PACKET_SIZE     = const(64)
+_BUFFER_SIZE        = const(512)   # Default room for 8 full-size Bulk packets per direction, so bursts are queued instead of NAKed
 # _ADD_EXTERNAL_JACKS = const(False) # External Jacks are optional
 # _MAX_CABLES         = const(16)   # USB MIDI 1.0: up to 16 cables per Endpoint
 _MAX_GROUPS         = const(16)    # USB MIDI 2.0: up to 16 Groups per Endpoint
 
+# Size in bytes of a UMP per Message Type (upper 4 bits of its first byte): 32-bit for Utility, System, MIDI 1.0 Channel Voice and 6-7
+# (reserved), 64-bit for Data (System Exclusive 7), MIDI 2.0 Channel Voice and 8-A (reserved), 96-bit for B-C (reserved) and 128-bit for
+# Data (including System Exclusive 8), Flex Data, E (reserved) and UMP Stream
+_UMP_SIZES = b'\x04\x04\x04\x08\x08\x10\x04\x04\x08\x08\x08\x0C\x0C\x10\x10\x10'
+
+# Status byte per MIDI channel (0 to 15) of the messages sent by the helper functions, looked up instead of combined on each call; channels
+# above 15 raise an IndexError, but -16 to -1 index from the end and wrap around to channels 0 to 15 (so -1 sends on channel 15)
+_NOTE_OFF_STATUS       = bytes(range(0x80, 0x90))
+_NOTE_ON_STATUS        = bytes(range(0x90, 0xA0))
+_CONTROL_CHANGE_STATUS = bytes(range(0xB0, 0xC0))
+
+# Descriptor record formats (packed once per port or Endpoint)
+_AC_HEADER  = '<BBBHHBB'     # Class-specific Audio Control interface header
+_MS_HEADER  = '<BBBHH'       # Class-specific MIDI Streaming interface header
+_GTB_HEADER = '<BBBH'        # Group Terminal Block header
+_GTB        = '<BBBBBBBBBHH' # Group Terminal Block
+_ENDPOINT   = '<BBBBHB'      # Standard Bulk Endpoint
+
 class MidiMulti(Interface):
-    '''USB MIDI 2.0 device class supporting up to 16 MIDI ports in the form of groups'''
+    '''USB MIDI 2.0 device class supporting up to 16 MIDI ports in the form of groups; received UMPs are passed as callback(ump_bytes), with
+    ump_bytes a memoryview only valid during the call (see README.md for the other parameters)'''
 
-    def __init__(self, num_ports=1, port_names=None, callback=None):
+    def __init__(self, num_ports=1, port_names=None, callback=None, raw_in=False, poll_in=False, direct_in=False,
+                 tx_buf_size=_BUFFER_SIZE, rx_buf_size=_BUFFER_SIZE):
+        if tx_buf_size < _EP_PACKET_SIZE or rx_buf_size < _EP_PACKET_SIZE:
+            raise ValueError(f'tx_buf_size ({tx_buf_size}) and rx_buf_size ({rx_buf_size}) must be >= {_EP_PACKET_SIZE}')
+        if poll_in and direct_in:
+            raise ValueError('poll_in and direct_in cannot both be True')
         if not 1 <= num_ports <= _MAX_GROUPS:
             raise ValueError(f'num_ports ({num_ports}) must be >= 1 and <= {_MAX_GROUPS}')
         super().__init__()
         self.num_ports = num_ports
-        port_names = port_names or [None for _ in range(num_ports)]
-        if (n := len(port_names)) > num_ports:
-            del port_names[num_ports - n:]
-        while len(port_names) < num_ports:
-            port_names.append(None)
-        self.port_names = port_names
+        # One name (or None) per port, truncated or padded with None, built in one pass into a new list so the caller's sequence isn't modified
+        num_names = len(port_names) if port_names else 0
+        self.port_names = [port_names[i] if i < num_names else None for i in range(num_ports)]
+        # OUT and IN Endpoint descriptors, each followed by the same class-specific MIDI Streaming Bulk Endpoint descriptor (associated with all
+        # Group Terminal Blocks, which have IDs 1 to num_ports), built once as one block of which desc_cfg only fills in the Endpoint addresses
+        self._endpoints = (endpoints := bytearray(2 * (ep_size := 7 + 4 + num_ports)))
+        for offset in (0, ep_size):
+            pack_into(_ENDPOINT, endpoints, offset,
+                      7,               # bLength (size of the descriptor in bytes)
+                      5,               # bDescriptorType=ENDPOINT
+                      0,               # bEndpointAddress (0 to 15 with bit7=0 for OUT, bit7=1 for IN; filled in by desc_cfg)
+                      2,               # bmAttributes (2 for Bulk, not shared; alternative: 3 for Interval)
+                      _EP_PACKET_SIZE, # wMaxPacketSize
+                      0                # bInterval (ignored for Bulk - set to 0; alternative: 1 for Interval)
+            )
+            endpoints[offset + 7:offset + ep_size] = bytes((
+                4 + num_ports, # bLength (size of the descriptor in bytes)
+                0x25,          # bDescriptorType=CS_ENDPOINT
+                2,             # bDescriptorSubtype=MS_GENERAL_2_0
+                num_ports      # bNumGrpTrmBlock (number of Group Terminal Blocks)
+            )) + bytes(range(1, 1 + num_ports)) # baAssocGrpTrmBlkID(1 to n) (IDs of the associated Group Terminal Blocks)
+        self._ep_in_offset = ep_size + 2 # Offset of bEndpointAddress of the IN Endpoint in self._endpoints
+        self._gtb_block = None # (index of first port name string, Group Terminal Block descriptors block), see desc_cfg
         self._in_callback = callback
+        self._raw_in = raw_in
+        self._poll_in = poll_in
+        self._direct_in = direct_in
         self.ep_out = None
         self.ep_in = None
-        self._rx_buffer = Buffer(_BUFFER_SIZE)
-        self._tx_buffer = Buffer(_BUFFER_SIZE)
+        self._rx_buffer = Buffer(rx_buf_size)
+        self._tx_buffer = Buffer(tx_buf_size)
+        self._tx_hold = False # Set by hold() to queue UMPs without sending them until flush() is called
+        self._rx_sizes = bytearray(rx_buf_size // 4) # Sizes of the UMPs found in the RX buffer by _scan_umps (at least 4 bytes each)
+        # Bound once, not per transfer
+        self._tx_cb_ref = self._tx_cb
+        self._rx_cb_ref = self._rx_cb
+        self._on_rx_ref = self._on_rx
+        self._rx_scheduled = False
 
     # Helper functions for sending common MIDI messages
 
     def note_on(self, group, channel, note, velocity=0x40):
-        self.send_ump(bytes((0x20 | (group & 0x0F), 0x90 | channel, note, velocity)))
+        return self._send_ump_32(0x20 | (group & 0x0F), _NOTE_ON_STATUS[channel], note, velocity)
 
     def note_off(self, group, channel, note, velocity=0x40):
-        self.send_ump(bytes((0x20 | (group & 0x0F), 0x80 | channel, note, velocity)))
+        return self._send_ump_32(0x20 | (group & 0x0F), _NOTE_OFF_STATUS[channel], note, velocity)
 
     def control_change(self, group, channel, controller, value):
-        self.send_ump(bytes((0x20 | (group & 0x0F), 0xB0 | channel, controller, value)))
+        return self._send_ump_32(0x20 | (group & 0x0F), _CONTROL_CHANGE_STATUS[channel], controller, value)
+
+    def send_message(self, group, status, data_1=0, data_2=0):
+        '''Queue a MIDI 1.0 message of up to 3 bytes as a 32-bit UMP, with Message Type 0x2 (MIDI 1.0 Channel Voice Messages) or 0x1 (System
+        Real Time and System Common Messages) derived from the status byte (System Exclusive needs to be sent with send_ump as Data
+        Messages); returns False if failed due to the TX buffer being full'''
+        if status < 0x80:
+            raise ValueError(f'status ({status}) must be a status byte (>= 0x80)')
+        return self._send_ump_32((0x20 if status < 0xF0 else 0x10) | (group & 0x0F), status, data_1, data_2)
 
     def send_ump(self, ump_bytes):
-        '''Queue a UMP (Universal MIDI Packet) to be sent to the host; takes a group number (port) and a 4, 8, 12 or 16 bytes UMP; returns
-        False if failed due to the TX buffer being full'''
+        '''Queue a UMP (Universal MIDI Packet) to be sent to the host; takes a 4, 8, 12 or 16 bytes UMP (Group included) as bytes, bytearray or
+        memoryview, e.g. a reused bytearray of which only the changing bytes are updated (no intermediate copy is made); returns False if
+        failed due to the TX buffer being full'''
         _buffer = self._tx_buffer
         w = _buffer.pend_write()
         if len(w) < (n := len(ump_bytes)):
@@ -78,6 +140,33 @@ class MidiMulti(Interface):
         self._tx_xfer()
         return True
 
+    def _send_ump_32(self, byte_0, byte_1, byte_2, byte_3):
+        '''Queue a 4 bytes (32-bit) UMP by writing its bytes straight into the TX buffer, without creating an intermediate bytes object or
+        memoryview; returns False if failed due to the TX buffer being full'''
+        if not self._tx_buffer.write_4(byte_0, byte_1, byte_2, byte_3):
+            return False # TX buffer full
+        self._tx_xfer()
+        return True
+
+    def hold(self):
+        '''Queue UMPs without sending them until flush() is called, so a group of messages (e.g. a chord) goes to the host in a single
+        transfer (sent as consecutive Bulk packets); as many UMPs as fit in the TX buffer can be queued (128 32-bit UMPs with the default
+        tx_buf_size), after which sending returns False'''
+        self._tx_hold = True
+
+    def flush(self):
+        '''Send all UMPs queued since hold() was called'''
+        self._tx_hold = False
+        self._tx_xfer()
+
+    def poll(self):
+        '''Process the MIDI data received since the previous call; only needed (and to be called from the main loop) if poll_in is True,
+        instead of the callback being called via micropython.schedule; returns True if anything was received'''
+        if self._rx_scheduled:
+            self._on_rx(None)
+            return True
+        return False
+
     def desc_cfg(self, desc, itf_num, ep_num, strs):
         # Interface Association Descriptor
         desc.interface_assoc(
@@ -88,6 +177,7 @@ class MidiMulti(Interface):
             bFunctionProtocol = 0,
             iFunction         = 0
         )
+        num_ports = self.num_ports
         _interface = desc.interface
         # Audio Control interface
         _interface(
@@ -99,15 +189,14 @@ class MidiMulti(Interface):
             bInterfaceProtocol = 0,       # Unused
             iInterface         = 0        # Index of string descriptor or 0 if none assigned
         )
-        _pack = desc.pack
-        _pack('<BBBHHBB', 
-              9,          # bLength (size of the descriptor in bytes)
-              0x24,       # bDescriptorType=CS_INTERFACE
-              1,          # bDescriptorSubType=MS_HEADER
-              0x0100,     # bcdADC=MS_MIDI_1_0
-              9,          # wTotalLength (total size of class specific descriptors)
-              1,          # bInCollection (number of streaming interfaces)
-              itf_num + 1 # baInterfaceNr(1) (assign MIDIStreaming interface 1)
+        desc.pack(_AC_HEADER,
+                  9,          # bLength (size of the descriptor in bytes)
+                  0x24,       # bDescriptorType=CS_INTERFACE
+                  1,          # bDescriptorSubType=MS_HEADER
+                  0x0100,     # bcdADC=MS_MIDI_1_0
+                  9,          # wTotalLength (total size of class specific descriptors)
+                  1,          # bInCollection (number of streaming interfaces)
+                  itf_num + 1 # baInterfaceNr(1) (assign MIDIStreaming interface 1)
         )
         # # MIDI Streaming interface for Alternate Setting 0 (USB MIDI 1.0)
         # _interface(
@@ -242,16 +331,37 @@ class MidiMulti(Interface):
         # Class-specific MIDI Streaming interface header for Alternate Setting 1 (USB MIDI 2.0)
 ######
         # wTotalLength = 17 + self.num_ports * 18
-        _pack('<BBBHH',
-              7,      # bLength (size of the descriptor in bytes)
-              0x24,   # bDescriptorType=CS_INTERFACE
-              1,      # bDescriptorSubType=MS_HEADER
-              0x0200, # bcdADC=MS_MIDI_2_0
+        desc.pack(_MS_HEADER,
+                  7,      # bLength (size of the descriptor in bytes)
+                  0x24,   # bDescriptorType=CS_INTERFACE
+                  1,      # bDescriptorSubType=MS_HEADER
+                  0x0200, # bcdADC=MS_MIDI_2_0
 ######
-              7       # wTotalLength (needs to match bLength)
-            #   wTotalLength # wTotalLength (total size of class specific descriptors)
+                  7       # wTotalLength (needs to match bLength)
+                    #  wTotalLength # wTotalLength (total size of class specific descriptors)
         )
-        # Groups for each IN and OUT Port (USB MIDI 2.0)
+        # Groups for each IN and OUT Port (USB MIDI 2.0); these only depend on the configuration and on the index of the first port name
+        # string, so the block is built once and reused on re-initialisation (when only sizing the descriptor, any cached block will do)
+        if (gtb_block := self._gtb_block) is None or (desc.b is not None and gtb_block[0] != len(strs)):
+            self._gtb_block = (gtb_block := (len(strs), self._build_gtb_block(strs)))
+        else:
+            strs.extend(name for name in self.port_names if name is not None)
+        desc.extend(gtb_block[1])
+        # OUT and IN Endpoints (USB MIDI 2.0), each with its class-specific MIDI Streaming Bulk Endpoint descriptor
+        self.ep_out = ep_num
+        self.ep_in = (ep_in := ep_num | 0x80)
+        endpoints = self._endpoints
+        endpoints[2] = ep_num
+        endpoints[self._ep_in_offset] = ep_in
+        desc.extend(endpoints)
+
+    def _build_gtb_block(self, strs):
+        '''Build the Group Terminal Block descriptors for all ports as one block and add the port names to strs'''
+        num_ports = self.num_ports
+        # The records are packed into a single block at a running offset, which is copied into the descriptor in one go by desc_cfg
+        wTotalLength = 5 + num_ports * 13
+        block = bytearray(num_ports * (5 + 13))
+        offset = 0
         for i, name in enumerate(self.port_names):
             # Embedded IN Jack for each virtual OUT Cable (required - create dummy if no OUT port is to be exposed)
             if name is None:
@@ -259,60 +369,27 @@ class MidiMulti(Interface):
             else:
                 iBlockItem = len(strs)
                 strs.append(name)
-            wTotalLength = 5 + (num_ports := self.num_ports) * 13
-            _pack('<BBBH',
-                  5,           # bLength (size of the descriptor in bytes)
-                  0x26,        # bDescriptorType=CS_GR_TRM_BLOCK
-                  1,           # bDescriptorSubType=GR_TRM_BLOCK_HEADER
-                  wTotalLength # wTotalLength (total size of class specific descriptors)
+            pack_into(_GTB_HEADER, block, offset,
+                      5,           # bLength (size of the descriptor in bytes)
+                      0x26,        # bDescriptorType=CS_GR_TRM_BLOCK
+                      1,           # bDescriptorSubType=GR_TRM_BLOCK_HEADER
+                      wTotalLength # wTotalLength (total size of class specific descriptors)
             )
-            _pack('<BBBBBBBBBHH',
-                  13,         # bLength (size of the descriptor in bytes)
-                  0x26,       # bDescriptorType=CS_GR_TRM_BLOCK
-                  2,          # bDescriptorSubType=GR_TRM_BLOCK
-                  i + 1,      # bGrpTrmBlkID (unique ID)                
-                  0,          # bGrpTrmBlkType=BIDIRECTIONAL (alternatives: INPUT_ONLY = 1 OUTPUT_ONLY = 2)
-                  0,          # nGroupTrm (first member Group Terminal in this block; must be in range 0 to 15)
-                  num_ports,  # nNumGroupTrm (number of member Group Terminals spanned; must be in range 1 to 15 - nGroupTrm)
-                  iBlockItem, # iBlockItem (index of string descriptor or 0 if none assigned???)
-                  3,          # bMIDIProtocol=MIDI_1_0_UP_TO_128_BITS (altenative: MIDI_1_0_UP_TO_64_BITS = 1)
-                  0,          # wMaxInputBandwidth (0 for unknown or not fixed, alternative: 1 for rounded version of 31.25kb/s)
-                  0,          # wMaxOutputBandwidth (0 for unknown or not fixed, alternative: 1 for rounded version of 31.25kb/s)
+            pack_into(_GTB, block, offset + 5,
+                      13,         # bLength (size of the descriptor in bytes)
+                      0x26,       # bDescriptorType=CS_GR_TRM_BLOCK
+                      2,          # bDescriptorSubType=GR_TRM_BLOCK
+                      i + 1,      # bGrpTrmBlkID (unique ID)
+                      0,          # bGrpTrmBlkType=BIDIRECTIONAL (alternatives: INPUT_ONLY = 1 OUTPUT_ONLY = 2)
+                      0,          # nGroupTrm (first member Group Terminal in this block; must be in range 0 to 15)
+                      num_ports,  # nNumGroupTrm (number of member Group Terminals spanned; must be in range 1 to 15 - nGroupTrm)
+                      iBlockItem, # iBlockItem (index of string descriptor or 0 if none assigned???)
+                      3,          # bMIDIProtocol=MIDI_1_0_UP_TO_128_BITS (altenative: MIDI_1_0_UP_TO_64_BITS = 1)
+                      0,          # wMaxInputBandwidth (0 for unknown or not fixed, alternative: 1 for rounded version of 31.25kb/s)
+                      0,          # wMaxOutputBandwidth (0 for unknown or not fixed, alternative: 1 for rounded version of 31.25kb/s)
             )
-        # OUT Endpoint (USB MIDI 2.0)
-        self.ep_out = ep_num
-        _pack('<BBBBHB',
-              7,               # bLength (size of the descriptor in bytes)
-              5,               # bDescriptorType=ENDPOINT
-              ep_num,          # bEndpointAddress (0 to 15 with bit7=0 for OUT)
-              2,               # bmAttributes (2 for Bulk, not shared; alternative: 3 for Interval)
-              _EP_PACKET_SIZE, # wMaxPacketSize
-              0                # bInterval (ignored for Bulk - set to 0; alternative: 1 for Interval)
-        )
-        _pack('<BBBB' + num_ports * 'B',
-              4 + num_ports,                     # bLength (size of the descriptor in bytes)
-              0x25,                              # bDescriptorType=CS_ENDPOINT
-              2,                                 # bDescriptorSubtype=MS_GENERAL_2_0
-              num_ports,                         # bNumGrpTrmBlock (number of Group Terminal Blocks)
-              *[i + 1 for i in range(num_ports)] # baAssocGrpTrmBlkID(1 to n) (IDs of the associated Group Terminal Blocks)
-        )
-        # IN Endpoint (USB MIDI 2.0)
-        self.ep_in = (ep_in := ep_num | 0x80)
-        _pack('<BBBBHB',
-              7,               # bLength (size of the descriptor in bytes)
-              5,               # bDescriptorType=ENDPOINT
-              ep_in,           # bEndpointAddress (0 to 15 with bit7=1 for IN: 128 to 143)
-              2,               # bmAttributes (2 for Bulk, not shared; alternative: 3 for Interval)
-              _EP_PACKET_SIZE, # wMaxPacketSize
-              0                # bInterval (ignored for Bulk - set to 0; alternative: 1 for Interval)
-        )
-        _pack('<BBBB' + num_ports * 'B',
-              4 + num_ports,   # bLength (size of the descriptor in bytes)
-              0x25,            # bDescriptorType=CS_ENDPOINT
-              2,               # bDescriptorSubtype=MS_GENERAL_2_0
-              num_ports,       # bNumGrpTrmBlock (number of Group Terminal Blocks)
-              *[i + 1 for i in range(num_ports)] # baAssocGrpTrmBlkID(1 to n) (IDs of the associated Group Terminal Blocks)
-        )
+            offset += 5 + 13
+        return block
 
     def num_itfs(self):
         return 2
@@ -329,40 +406,108 @@ class MidiMulti(Interface):
     def _tx_xfer(self):
         '''Keep an active IN transfer to send data to the host, whenever there is data to send'''
         _buffer = self._tx_buffer
-        if self.is_open() and not self.xfer_pending(ep_in := self.ep_in) and _buffer.readable():
-            self.submit_xfer(ep_in, _buffer.pend_read(), self._tx_cb)
+        # self._open is the flag is_open() returns
+        if not self._tx_hold and self._open and not self.xfer_pending(ep_in := self.ep_in) and _buffer.readable():
+            # Can race with _tx_cb submitting; the loser gets a RuntimeError, as the winner's transfer already takes the data
+            try:
+                # Everything queued, in one transfer
+                self.submit_xfer(ep_in, _buffer.pend_read(), self._tx_cb_ref)
+            except RuntimeError:
+                pass
 
     def _tx_cb(self, ep, res, num_bytes):
+        _buffer = self._tx_buffer
         if res == 0:
-            self._tx_buffer.finish_read(num_bytes)
-        self._tx_xfer()
+            _buffer.finish_read(num_bytes)
+        # Submit everything queued while this transfer was in flight as the next one, directly: ep is the IN Endpoint and it doesn't count
+        # as pending while its own callback runs
+        if not self._tx_hold and self._open and _buffer.readable():
+            try:
+                self.submit_xfer(ep, _buffer.pend_read(), self._tx_cb_ref)
+            except RuntimeError:
+                pass # The main thread submitted it first
 
     def _rx_xfer(self):
         '''Keep an active OUT transfer to receive MIDI events from the host'''
         _buffer = self._rx_buffer
-        if self.is_open() and not self.xfer_pending(ep_out := self.ep_out) and _buffer.writable():
-            self.submit_xfer(ep_out, _buffer.pend_write(), self._rx_cb)
+        if self._open and not self.xfer_pending(ep_out := self.ep_out) and _buffer.writable() >= _EP_PACKET_SIZE:
+            # One Bulk packet per transfer: a longer OUT transfer would only complete on a short packet, holding back a full one
+            self.submit_xfer(ep_out, _buffer.pend_write(_EP_PACKET_SIZE), self._rx_cb_ref)
 
     def _rx_cb(self, ep, res, num_bytes):
         '''USB callback function to receive MIDI data'''
         if res == 0:
             self._rx_buffer.finish_write(num_bytes)
-            schedule(self._on_rx, None) # (QUESTION: avoid schedule because it makes it run on the main thread?)
+            if self._direct_in:
+                self._on_rx(None) # Decode and dispatch right away, in the USB callback (this also re-arms the OUT transfer)
+                return
+            # Decoding and the user callback run from the scheduler, draining everything received so far; only schedule it if it isn't
+            # pending yet, so a burst of transfers takes one slot in the schedule queue instead of one per transfer
+            if not self._rx_scheduled:
+                if self._poll_in:
+                    self._rx_scheduled = True # Picked up by the next poll() call, without a round trip through the schedule queue
+                else:
+                    try:
+                        schedule(self._on_rx_ref, None) # (QUESTION: avoid schedule because it makes it run on the main thread?)
+                        self._rx_scheduled = True
+                    except RuntimeError:
+                        # Schedule queue full: decode right away instead (as with direct_in), as the RX buffer may have no room left to
+                        # re-arm the OUT transfer, in which case no next transfer would pick the data up
+                        self._on_rx(None) # This also re-arms the OUT transfer
+                        return
         self._rx_xfer()
 
+    @micropython.native
     def _on_rx(self, _):
-        '''Receive MIDI events; called from self._rx_cb via micropython.schedule'''
+        '''Receive MIDI events; called from self._rx_cb via micropython.schedule, or from poll() (native code, as it runs for each batch of UMPs
+        received)'''
+        self._rx_scheduled = False # Cleared first, so data arriving while the callback runs schedules a new pass
         _buffer = self._rx_buffer
         m = _buffer.pend_read()
-        _callback = self._in_callback
-        i = 0
-        while i <= len(m) - 4:
-            ump_len = 4 * ((m[i] & 0x0F) + 1)
-            if ump_len > len(m) - i:
-                break # incomplete packet
+        sizes = self._rx_sizes
+        n = _scan_umps(m, len(m), sizes)
+        if (_callback := self._in_callback) is None:
+            _buffer.finish_read(n) # No callback: discard all complete UMPs without slicing them
+            self._rx_xfer()
+            return
+        if self._raw_in:
             try:
-                _callback(m[i:i + ump_len]) # type: ignore
+                _callback(m[:n]) # type: ignore
             except:
                 pass
-            i += ump_len
-        _buffer.finish_read(i)
\ No newline at end of file
+            _buffer.finish_read(n)
+            self._rx_xfer()
+            return
+        i = 0
+        k = 0
+        # Plain counter instead of range(), which would allocate an iterator object on each call; one exception handler for the whole batch
+        # instead of one per UMP: if the callback raises, its UMP is skipped and the loop is entered again for the rest
+        while i < n:
+            try:
+                while i < n:
+                    ump_len = sizes[k]
+                    _callback(m[i:i + ump_len]) # type: ignore
+                    i += ump_len
+                    k += 1
+            except:
+                i += sizes[k]
+                k += 1
+        _buffer.finish_read(i)
+        self._rx_xfer() # Re-arm the OUT transfer in case it stopped because the RX buffer was full
+
+@micropython.viper
+def _scan_umps(buf: ptr8, n: int, sizes: ptr8) -> int:
+    '''Store the size in bytes of each complete UMP (Universal MIDI Packet) in buf in sizes, based on the Message Type in the upper 4 bits
+    of its first byte; returns the number of bytes taken by the complete UMPs found (viper code, so the buffer is walked without creating any
+    objects)'''
+    ump_sizes = ptr8(_UMP_SIZES)
+    i = 0
+    count = 0
+    while i <= n - 4:
+        size = ump_sizes[buf[i] >> 4]
+        if size > n - i:
+            break # Incomplete UMP
+        sizes[count] = size
+        count += 1
+        i += size
+    return i
\ No newline at end of file
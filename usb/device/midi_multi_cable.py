@@ -35,62 +35,190 @@
     CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
     SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.'''
 
+import micropython
 from micropython import schedule
+from struct import pack_into
 from usb.device.core import Interface, Buffer
 
-_BUFFER_SIZE        = const(64)
 _EP_PACKET_SIZE     = const(64)
+_BUFFER_SIZE        = const(512)   # Default room for 8 full-size Bulk packets per direction, so bursts are queued instead of NAKed
 _ADD_EXTERNAL_JACKS = const(False) # External Jacks are optional
+_PACKET_SIZE        = const(4)    # Size of a USB MIDI Event Packet in bytes
 _MAX_CABLES         = const(16)   # USB MIDI 1.0: up to 16 cables per Endpoint
 
+# Code Index Number (CIN) per System message (status byte 0xF0 to 0xFF), indexed by the low 4 bits of the status byte; for Channel messages
+# (0x80 to 0xEF) the CIN equals the upper 4 bits of the status byte
+_SYSTEM_CIN = b'\x04\x02\x03\x02\x05\x05\x05\x05\x0F\x0F\x0F\x0F\x0F\x0F\x0F\x0F'
+
+# Status byte per MIDI channel (0 to 15) of the messages sent by the helper functions, looked up instead of combined on each call; channels
+# above 15 raise an IndexError, but -16 to -1 index from the end and wrap around to channels 0 to 15 (so -1 sends on channel 15)
+_NOTE_OFF_STATUS       = bytes(range(0x80, 0x90))
+_NOTE_ON_STATUS        = bytes(range(0x90, 0xA0))
+_CONTROL_CHANGE_STATUS = bytes(range(0xB0, 0xC0))
+
+# Descriptor record formats (packed once per Jack or Endpoint)
+_AC_HEADER = '<BBBHHBB'   # Class-specific Audio Control interface header
+_MS_HEADER = '<BBBHH'     # Class-specific MIDI Streaming interface header
+_JACK_IN   = '<BBBBBB'    # MIDI IN Jack
+_JACK_OUT  = '<BBBBBBBBB' # MIDI OUT Jack
+_ENDPOINT  = '<BBBBHB'    # Standard Bulk Endpoint
+_INTERFACE = '<BBBBBBBBB' # Standard interface
+
+# Offsets in the descriptors block of the fields filled in with the interface numbers by desc_cfg
+_AC_ITF_NUM_OFFSET       = const(2)  # bInterfaceNumber of the Audio Control interface
+_AC_HEADER_ITF_NR_OFFSET = const(17) # baInterfaceNr(1) of the class-specific Audio Control interface header
+_MS_ITF_NUM_OFFSET       = const(20) # bInterfaceNumber of the MIDI Streaming interface
+
 class MidiMulti(Interface):
-    '''USB MIDI 1.0 device class supporting up to 16 MIDI ports in the form of virtual MIDI IN and OUT cables'''
+    '''USB MIDI 1.0 device class supporting up to 16 MIDI ports in the form of virtual MIDI IN and OUT cables; received MIDI Event Packets are
+    passed as in_callback(cable, cin, byte_0, byte_1, byte_2), formerly in_callback(cable, packet) (see README.md for the other parameters)'''
 
-    def __init__(self, num_in=1, num_out=1, port_names=None, in_callback=None):
+    def __init__(self, num_in=1, num_out=1, port_names=None, in_callback=None, raw_in=False, poll_in=False, direct_in=False,
+                 tx_buf_size=_BUFFER_SIZE, rx_buf_size=_BUFFER_SIZE):
+        if tx_buf_size < _EP_PACKET_SIZE or rx_buf_size < _EP_PACKET_SIZE:
+            raise ValueError(f'tx_buf_size ({tx_buf_size}) and rx_buf_size ({rx_buf_size}) must be >= {_EP_PACKET_SIZE}')
+        if poll_in and direct_in:
+            raise ValueError('poll_in and direct_in cannot both be True')
         if not 1 <= num_in <= _MAX_CABLES:
             raise ValueError(f'num_in ({num_in}) must be >= 1 and <= {_MAX_CABLES}')
         if not 1 <= num_out <= _MAX_CABLES:
             raise ValueError(f'num_out ({num_out}) must be >= 1 and <= {_MAX_CABLES}')
+        if raw_in and not (in_callback is None or callable(in_callback)):
+            raise ValueError('raw_in requires a single in_callback, not a callback per Cable')
         super().__init__()
         self.num_in = num_in
         self.num_out = num_out
+        # Cable numbers are validated with a single mask test if num_out is a power of two, otherwise with a range compare
+        self._out_mask = ~(num_out - 1) if num_out & (num_out - 1) == 0 else None
+        # Precomputed first bytes (Cable Number and CIN) of the MIDI Event Packets sent by the helper functions, indexed by Cable number
+        self._note_off_headers = bytes((cable << 4) | 0x8 for cable in range(num_out))
+        self._note_on_headers = bytes((cable << 4) | 0x9 for cable in range(num_out))
+        self._control_change_headers = bytes((cable << 4) | 0xB for cable in range(num_out))
         self.num_jack_sets = (num_jack_sets := max(num_in, num_out))
-        port_names = port_names or [None for _ in range(num_in)]
-        if (n := len(port_names)) > num_jack_sets:
-            del port_names[num_jack_sets - n:]
-        while len(port_names) < num_jack_sets:
-            port_names.append(None)
-        self.port_names = port_names
+        # Embedded Jack IDs associated with the shared Endpoints (each set of Jacks takes 2 IDs, or 4 if External Jacks are added; the Embedded
+        # OUT Jack follows the Embedded IN Jack, or the External IN Jack if added, of the same set), as bytes to be copied into the descriptors
+        jack_step = 4 if _ADD_EXTERNAL_JACKS else 2
+        out_emb_offset = 2 if _ADD_EXTERNAL_JACKS else 1
+        self._in_emb_jack_ids = bytes(range(1, 1 + num_in * jack_step, jack_step))
+        self._out_emb_jack_ids = bytes(range(1 + out_emb_offset, 1 + out_emb_offset + num_out * jack_step, jack_step))
+        # One name (or None) per port, truncated or padded with None, built in one pass into a new list so the caller's sequence isn't modified
+        num_names = len(port_names) if port_names else 0
+        self.port_names = [port_names[i] if i < num_names else None for i in range(num_jack_sets)]
         self._in_callback = in_callback
+        self._raw_in = raw_in
+        self._poll_in = poll_in
+        self._direct_in = direct_in
+        # Callback per Cable, indexed directly by the Cable Number of a received packet, plus a bitmask with bit n set if Cable n has a callback
+        # (and is an exposed MIDI IN port); packets for other Cables are ignored
+        if in_callback is None or callable(in_callback):
+            in_callbacks = [in_callback] * num_in
+        else:
+            in_callbacks = list(in_callback[:num_in])
+        in_callbacks += [None] * (_MAX_CABLES - len(in_callbacks))
+        self._in_callbacks = tuple(in_callbacks)
+        self._rx_cable_mask = sum(1 << cable for cable, callback in enumerate(in_callbacks) if callback is not None)
+        self._desc_block = None # (index of first port name string, descriptors block, Endpoint address offsets), see desc_cfg
         self.ep_out = None
         self.ep_in = None
-        self._rx_buffer = Buffer(_BUFFER_SIZE)
-        self._tx_buffer = Buffer(_BUFFER_SIZE)
+        self._rx_buffer = Buffer(rx_buf_size)
+        self._tx_buffer = Buffer(tx_buf_size)
+        self._tx_hold = False # Set by hold() to queue MIDI Event Packets without sending them until flush() is called
+        # Bound once, not per transfer
+        self._tx_cb_ref = self._tx_cb
+        self._rx_cb_ref = self._rx_cb
+        self._on_rx_ref = self._on_rx
+        self._rx_scheduled = False
 
     # Helper functions for sending common MIDI messages
 
+    # The helper functions take the packet header from a per-cable table instead of using send_event's cable validation: a cable number
+    # >= num_out raises an IndexError, a negative one is rejected explicitly (as it would wrap around in the table)
+
     def note_on(self, cable, channel, note, velocity=0x40):
-        self.send_event(cable, 0x9, 0x90 | channel, note, velocity)
+        if cable < 0:
+            raise ValueError(f'cable ({cable}) must be >= 0 and < {self.num_out}')
+        return self._send_4(self._note_on_headers[cable], _NOTE_ON_STATUS[channel], note, velocity)
 
     def note_off(self, cable, channel, note, velocity=0x40):
-        self.send_event(cable, 0x8, 0x80 | channel, note, velocity)
+        if cable < 0:
+            raise ValueError(f'cable ({cable}) must be >= 0 and < {self.num_out}')
+        return self._send_4(self._note_off_headers[cable], _NOTE_OFF_STATUS[channel], note, velocity)
 
     def control_change(self, cable, channel, controller, value):
-        self.send_event(cable, 0xB, 0xB0 | channel, controller, value)
+        if cable < 0:
+            raise ValueError(f'cable ({cable}) must be >= 0 and < {self.num_out}')
+        return self._send_4(self._control_change_headers[cable], _CONTROL_CHANGE_STATUS[channel], controller, value)
+
+    def send_message(self, cable, status, data_1=0, data_2=0):
+        '''Queue a MIDI message of up to 3 bytes to be sent to the host, deriving the CIN from the status byte (System Exclusive needs to be
+        sent with send_event); returns False if failed due to the TX buffer being full'''
+        if status < 0x80:
+            raise ValueError(f'status ({status}) must be a status byte (>= 0x80)')
+        cin = status >> 4 if status < 0xF0 else _SYSTEM_CIN[status & 0x0F]
+        return self.send_event(cable, cin, status, data_1, data_2)
 
     def send_event(self, cable, cin, data_0, data_1=0, data_2=0):
         '''Queue a MIDI Event Packet to be sent to the host; takes a Cable number (port), a USB-MIDI Code Index Number (CIN) and up to three
         MIDI data bytes; returns False if failed due to the TX buffer being full'''
+        if (mask := self._out_mask) is None:
+            if not 0 <= cable < self.num_out:
+                raise ValueError(f'cable ({cable}) must be >= 0 and < {self.num_out}')
+        elif cable & mask:
+            raise ValueError(f'cable ({cable}) must be >= 0 and < {self.num_out}')
+        return self._send_4((cable << 4) | cin, data_0, data_1, data_2) # First 4 bits: Cable, second 4 bits: CIN
+
+    def _send_4(self, header, data_0, data_1, data_2):
+        '''Queue a MIDI Event Packet by writing its 4 bytes straight into the TX buffer (no intermediate tuple, bytes object or memoryview);
+        returns False if failed due to the TX buffer being full'''
+        if not self._tx_buffer.write_4(header, data_0, data_1, data_2):
+            return False # TX buffer full
+        self._tx_xfer()
+        return True
+
+    def send_packet(self, packet, cable=None):
+        '''Queue a complete 4 bytes MIDI Event Packet (Cable number and CIN included) to be sent to the host, e.g. a reused bytearray of which
+        only the changing bytes are updated or a received packet which is passed on; if cable is given, the packet is sent on that Cable
+        instead of the one in its first byte (without copying or modifying packet); returns False if failed due to the TX buffer being full'''
+        if cable is not None:
+            if (mask := self._out_mask) is None:
+                if not 0 <= cable < self.num_out:
+                    raise ValueError(f'cable ({cable}) must be >= 0 and < {self.num_out}')
+            elif cable & mask:
+                raise ValueError(f'cable ({cable}) must be >= 0 and < {self.num_out}')
         _buffer = self._tx_buffer
         w = _buffer.pend_write()
-        if len(w) < 4:
+        if len(w) < _PACKET_SIZE:
             return False # TX buffer full
-        status = (cable << 4) | cin # First 4 bits: Cable, second 4 bits: CIN
-        w[:4] = bytes((status, data_0, data_1, data_2))
-        _buffer.finish_write(4)
+        if cable is None:
+            w[:_PACKET_SIZE] = packet
+        else:
+            w[0] = (cable << 4) | (packet[0] & 0x0F)
+            w[1] = packet[1]
+            w[2] = packet[2]
+            w[3] = packet[3]
+        _buffer.finish_write(_PACKET_SIZE)
         self._tx_xfer()
         return True
 
+    def hold(self):
+        '''Queue MIDI Event Packets without sending them until flush() is called, so a group of messages (e.g. a chord) goes to the host in a
+        single transfer (sent as consecutive Bulk packets); as many packets as fit in the TX buffer can be queued (128 with the default
+        tx_buf_size), after which sending returns False'''
+        self._tx_hold = True
+
+    def flush(self):
+        '''Send all MIDI Event Packets queued since hold() was called'''
+        self._tx_hold = False
+        self._tx_xfer()
+
+    def poll(self):
+        '''Process the MIDI data received since the previous call; only needed (and to be called from the main loop) if poll_in is True,
+        instead of the callback being called via micropython.schedule; returns True if anything was received'''
+        if self._rx_scheduled:
+            self._on_rx(None)
+            return True
+        return False
+
     def desc_cfg(self, desc, itf_num, ep_num, strs):
         # Interface Association Descriptor
 
@@ -100,143 +228,177 @@ class MidiMulti(Interface):
         # an IAD, which solves the above mentioned error, but then the MIDI ports are not reconginised correctly anymore. 
 
         # desc.interface_assoc(itf_num, 2, 1, 1, 0)
-        _interface = desc.interface
+
+        # The descriptors only depend on the configuration and on the index of the first port name string, so they are built once as one
+        # block and reused on re-initialisation (when only sizing the descriptor, any cached block will do); only the interface numbers and
+        # Endpoint addresses are filled in on each call
+        if (desc_block := self._desc_block) is None or (desc.b is not None and desc_block[0] != len(strs)):
+            self._desc_block = (desc_block := self._build_desc_block(strs))
+        else:
+            strs.extend(name for name in self.port_names if name is not None)
+        _, block, ep_out_offset, ep_in_offset = desc_block
+        block[_AC_ITF_NUM_OFFSET] = itf_num
+        block[_AC_HEADER_ITF_NR_OFFSET] = itf_num + 1
+        block[_MS_ITF_NUM_OFFSET] = itf_num + 1
+        self.ep_out = ep_num
+        block[ep_out_offset] = ep_num
+        self.ep_in = (ep_in := ep_num | 0x80)
+        block[ep_in_offset] = ep_in
+        desc.extend(block)
+
+    def _build_desc_block(self, strs):
+        '''Build the interface, Jack and Endpoint descriptors as one block and add the port names to strs; returns (index of first port name
+        string, block, offset of OUT Endpoint address, offset of IN Endpoint address), with the interface numbers and Endpoint addresses to
+        be filled in by desc_cfg'''
+        first_str = len(strs)
+        num_in = self.num_in
+        num_out = self.num_out
+        num_jack_sets = self.num_jack_sets
+        # The descriptors are packed into a single block at a running offset, which is copied into the descriptor in one go by desc_cfg
+        wTotalLength = 7 + 2 * num_jack_sets * (6 + 9) if _ADD_EXTERNAL_JACKS else 7 + num_jack_sets * (6 + 9)
+        block = bytearray(3 * 9 + wTotalLength + 2 * 7 + (4 + num_in) + (4 + num_out))
+        offset = 0
         # Audio Control interface
-        _interface(
-            bInterfaceNumber   = itf_num, # Unique ID
-            bNumEndpoints      = 0,       # No endpoints
-            bInterfaceClass    = 1,       # AUDIO
-            bInterfaceSubClass = 1,       # AUDIO_CONTROL
-            bInterfaceProtocol = 0,       # Unused
-            iInterface         = 0        # Index of string descriptor or 0 if none assigned
+        pack_into(_INTERFACE, block, offset,
+                  9, # bLength (size of the descriptor in bytes)
+                  4, # bDescriptorType=INTERFACE
+                  0, # bInterfaceNumber (unique ID, filled in by desc_cfg)
+                  0, # bAlternateSetting
+                  0, # bNumEndpoints (no endpoints)
+                  1, # bInterfaceClass=AUDIO
+                  1, # bInterfaceSubClass=AUDIO_CONTROL
+                  0, # bInterfaceProtocol (unused)
+                  0  # iInterface (index of string descriptor or 0 if none assigned)
         )
-        _pack = desc.pack
-        _pack('<BBBHHBB', 
-              9,          # bLength (size of the descriptor in bytes)
-              0x24,       # bDescriptorType=CS_INTERFACE
-              1,          # bDescriptorSubType=MS_HEADER
-              0x0100,     # bcdADC (USB MIDI 1.0 specs)
-              9,          # wTotalLength (total size of class specific descriptors)
-              1,          # bInCollection (number of streaming interfaces)
-              itf_num + 1 # baInterfaceNr(1) (assign MIDIStreaming interface 1)
+        offset += 9
+        pack_into(_AC_HEADER, block, offset,
+                  9,      # bLength (size of the descriptor in bytes)
+                  0x24,   # bDescriptorType=CS_INTERFACE
+                  1,      # bDescriptorSubType=MS_HEADER
+                  0x0100, # bcdADC (USB MIDI 1.0 specs)
+                  9,      # wTotalLength (total size of class specific descriptors)
+                  1,      # bInCollection (number of streaming interfaces)
+                  0       # baInterfaceNr(1) (assign MIDIStreaming interface 1, filled in by desc_cfg)
         )
+        offset += 9
         # MIDI Streaming interface
-        _interface(
-            bInterfaceNumber   = itf_num + 1, # Unique ID
-            bNumEndpoints      = 2,           # Number of MIDI endpoints assigned to this MIDI Streaming interface
-            bInterfaceClass    = 1,           # AUDIO
-            bInterfaceSubClass = 3,           # MIDISTREAMING
-            bInterfaceProtocol = 0,           # Unused
-            iInterface         = 0            # Index of string descriptor or 0 if none assigned
+        pack_into(_INTERFACE, block, offset,
+                  9, # bLength (size of the descriptor in bytes)
+                  4, # bDescriptorType=INTERFACE
+                  0, # bInterfaceNumber (unique ID, filled in by desc_cfg)
+                  0, # bAlternateSetting
+                  2, # bNumEndpoints (number of MIDI endpoints assigned to this MIDI Streaming interface)
+                  1, # bInterfaceClass=AUDIO
+                  3, # bInterfaceSubClass=MIDISTREAMING
+                  0, # bInterfaceProtocol (unused)
+                  0  # iInterface (index of string descriptor or 0 if none assigned)
         )
+        offset += 9
         # Class-specific MIDI Streaming interface header
-        wTotalLength = 7 + 2 * self.num_jack_sets * (6 + 9) if _ADD_EXTERNAL_JACKS else 7 + self.num_jack_sets * (6 + 9)
-        _pack('<BBBHH',
-              7,           # bLength (size of the descriptor in bytes)
-              0x24,        # bDescriptorType=CS_INTERFACE
-              1,           # bDescriptorSubType=MS_HEADER
-              0x0100,      # bcdADC (USB MIDI 1.0 specs)
-              wTotalLength # wTotalLength (total size of class specific descriptors)
+        pack_into(_MS_HEADER, block, offset,
+                  7,           # bLength (size of the descriptor in bytes)
+                  0x24,        # bDescriptorType=CS_INTERFACE
+                  1,           # bDescriptorSubType=MS_HEADER
+                  0x0100,      # bcdADC (USB MIDI 1.0 specs)
+                  wTotalLength # wTotalLength (total size of class specific descriptors)
         )
+        offset += 7
         # IN and OUT Jacks for each virtual IN and OUT Cable
-        in_emb_jack_ids = []
-        out_emb_jack_ids = []
-        num_in = self.num_in
-        num_out = self.num_out
-        jack_id = 1
-        for i, name in enumerate(self.port_names):
+        jack_step = 4 if _ADD_EXTERNAL_JACKS else 2
+        out_emb_offset = 2 if _ADD_EXTERNAL_JACKS else 1 # Embedded OUT Jack ID relative to the Embedded IN Jack ID of the same set
+        in_emb_jack_id = 1
+        for name in self.port_names:
             # Embedded IN Jack for each virtual OUT Cable (required - create dummy if no OUT port is to be exposed)
             if name is None:
                 iJack = 0
             else:
                 iJack = len(strs)
                 strs.append(name)
-            _pack('<BBBBBB',
-                  6,                           # bLength (size of the descriptor in bytes)
-                  0x24,                        # bDescriptorType=CS_INTERFACE
-                  2,                           # bDescriptorSubType=MIDI_IN_JACK
-                  1,                           # bJackType=EMBEDDED
-                  (in_emb_jack_id := jack_id), # bJackID (unique ID)
-                  iJack                        # iJack (index of string descriptor or 0 if none assigned)
+            pack_into(_JACK_IN, block, offset,
+                      6,              # bLength (size of the descriptor in bytes)
+                      0x24,           # bDescriptorType=CS_INTERFACE
+                      2,              # bDescriptorSubType=MIDI_IN_JACK
+                      1,              # bJackType=EMBEDDED
+                      in_emb_jack_id, # bJackID (unique ID)
+                      iJack           # iJack (index of string descriptor or 0 if none assigned)
             )
-            if i < num_in:
-                in_emb_jack_ids.append(jack_id)
-            jack_id += 1
+            offset += 6
             # External IN Jack for each virtual OUT Cable (create dummy if no OUT port is to be exposed)
             if _ADD_EXTERNAL_JACKS:
-                _pack('<BBBBBB',
-                    6,                           # bLength (size of the descriptor in bytes)
-                    0x24,                        # bDescriptorType=CS_INTERFACE
-                    2,                           # bDescriptorSubType=MIDI_IN_JACK
-                    2,                           # bJackType=EXTERNAL
-                    (in_ext_jack_id := jack_id), # bJackID (unique ID)
-                    0                            # iJack (index of string descriptor or 0 if none assigned)
+                pack_into(_JACK_IN, block, offset,
+                          6,                  # bLength (size of the descriptor in bytes)
+                          0x24,               # bDescriptorType=CS_INTERFACE
+                          2,                  # bDescriptorSubType=MIDI_IN_JACK
+                          2,                  # bJackType=EXTERNAL
+                          in_emb_jack_id + 1, # bJackID (unique ID)
+                          0                   # iJack (index of string descriptor or 0 if none assigned)
                 )
-                jack_id += 1
+                offset += 6
             # Embedded OUT Jack for each virtual OUT Cable (required - create dummy if no OUT port is to be exposed)
-            in_jack_id = in_ext_jack_id if _ADD_EXTERNAL_JACKS else in_emb_jack_id
-            _pack('<BBBBBBBBB',
-                  9,          # bLength (size of the descriptor in bytes)
-                  0x24,       # bDescriptorType=CS_INTERFACE
-                  3,          # bDescriptorSubType=MIDI_OUT_JACK
-                  1,          # bJackType=EMBEDDED
-                  jack_id,    # bJackID (unique ID)
-                  1,          # bNrInputPins (number of input Pins on this MIDI OUT Jack)
-                  in_jack_id, # baSourceID(1) (ID of the Entity to which the first Pin is connected)
-                  1,          # baSourcePIN(1) (output Pin number for the Entity to which the first Pin is connected)
-                  iJack       # iJack (index of string descriptor or 0 if none assigned)
+            out_emb_jack_id = in_emb_jack_id + out_emb_offset
+            pack_into(_JACK_OUT, block, offset,
+                      9,                   # bLength (size of the descriptor in bytes)
+                      0x24,                # bDescriptorType=CS_INTERFACE
+                      3,                   # bDescriptorSubType=MIDI_OUT_JACK
+                      1,                   # bJackType=EMBEDDED
+                      out_emb_jack_id,     # bJackID (unique ID)
+                      1,                   # bNrInputPins (number of input Pins on this MIDI OUT Jack)
+                      out_emb_jack_id - 1, # baSourceID(1) (ID of the External IN Jack if added, otherwise the Embedded IN Jack)
+                      1,                   # baSourcePIN(1) (output Pin number for the Entity to which the first Pin is connected)
+                      iJack                # iJack (index of string descriptor or 0 if none assigned)
             )
-            if i < num_out:
-                out_emb_jack_ids.append(jack_id)
-            jack_id += 1
+            offset += 9
             # External OUT Jack for each virtual OUT Cable (create dummy if no OUT port is to be exposed)
             if _ADD_EXTERNAL_JACKS:
-                _pack('<BBBBBBBBB',
-                    9,              # bLength (size of the descriptor in bytes)
-                    0x24,           # bDescriptorType=CS_INTERFACE
-                    3,              # bDescriptorSubType=MIDI_OUT_JACK
-                    2,              # bJackType=EXTERNAL
-                    jack_id,        # bJackID (unique ID)
-                    1,              # bNrInputPins (number of input Pins on this MIDI OUT Jack)
-                    in_emb_jack_id, # baSourceID(1) (ID of the Entity to which the first Pin is connected)
-                    1,              # baSourcePIN(1) (output Pin number for the Entity to which the first Pin is connected)
-                    0               # iJack (index of string descriptor or 0 if none assigned)
+                pack_into(_JACK_OUT, block, offset,
+                          9,                   # bLength (size of the descriptor in bytes)
+                          0x24,                # bDescriptorType=CS_INTERFACE
+                          3,                   # bDescriptorSubType=MIDI_OUT_JACK
+                          2,                   # bJackType=EXTERNAL
+                          out_emb_jack_id + 1, # bJackID (unique ID)
+                          1,                   # bNrInputPins (number of input Pins on this MIDI OUT Jack)
+                          in_emb_jack_id,      # baSourceID(1) (ID of the Entity to which the first Pin is connected)
+                          1,                   # baSourcePIN(1) (output Pin number for the Entity to which the first Pin is connected)
+                          0                    # iJack (index of string descriptor or 0 if none assigned)
                 )
-                jack_id += 1
+                offset += 9
+            in_emb_jack_id += jack_step
         # Single shared OUT Endpoint
-        self.ep_out = ep_num
-        _pack('<BBBBHB',
-              7,               # bLength (size of the descriptor in bytes)
-              5,               # bDescriptorType=ENDPOINT
-              ep_num,          # bEndpointAddress (0 to 15 with bit7=0 for OUT)
-              2,               # bmAttributes (2 for Bulk, not shared; alternative: 3 for Interval)
-              _EP_PACKET_SIZE, # wMaxPacketSize
-              0                # bInterval (ignored for Bulk - set to 0; alternative: 1 for Interval)
-        )
-        _pack('<BBBB' + num_in * 'B',
-              4 + num_in,      # bLength (size of the descriptor in bytes)
-              0x25,            # bDescriptorType=CS_ENDPOINT
-              1,               # bDescriptorSubtype=MS_GENERAL
-              num_in,          # bNumEmbMIDIJack (number of Embedded MIDI IN Jacks)
-              *in_emb_jack_ids # baAssocJackID(1 to n) (IDs of the associated Embedded MIDI IN Jacks)
+        ep_out_offset = offset + 2
+        pack_into(_ENDPOINT, block, offset,
+                  7,               # bLength (size of the descriptor in bytes)
+                  5,               # bDescriptorType=ENDPOINT
+                  0,               # bEndpointAddress (0 to 15 with bit7=0 for OUT, filled in by desc_cfg)
+                  2,               # bmAttributes (2 for Bulk, not shared; alternative: 3 for Interval)
+                  _EP_PACKET_SIZE, # wMaxPacketSize
+                  0                # bInterval (ignored for Bulk - set to 0; alternative: 1 for Interval)
         )
+        offset += 7
+        block[offset:offset + 4 + num_in] = bytes((
+            4 + num_in, # bLength (size of the descriptor in bytes)
+            0x25,       # bDescriptorType=CS_ENDPOINT
+            1,          # bDescriptorSubtype=MS_GENERAL
+            num_in      # bNumEmbMIDIJack (number of Embedded MIDI IN Jacks)
+        )) + self._in_emb_jack_ids # baAssocJackID(1 to n) (IDs of the associated Embedded MIDI IN Jacks)
+        offset += 4 + num_in
         # Single shared IN Endpoint
-        self.ep_in = (ep_in := ep_num | 0x80)
-        _pack('<BBBBHB',
-              7,               # bLength (size of the descriptor in bytes)
-              5,               # bDescriptorType=ENDPOINT
-              ep_in,           # bEndpointAddress (0 to 15 with bit7=1 for IN: 128 to 143)
-              2,               # bmAttributes (2 for Bulk, not shared; alternative: 3 for Interval)
-              _EP_PACKET_SIZE, # wMaxPacketSize
-              0                # bInterval (ignored for Bulk - set to 0; alternative: 1 for Interval)
-        )
-        _pack('<BBBB' + num_out * 'B',
-              4 + num_out,      # bLength (size of the descriptor in bytes)
-              0x25,             # bDescriptorType=CS_ENDPOINT
-              1,                # bDescriptorSubtype=MS_GENERAL
-              num_out,          # bNumEmbMIDIJack (number of Embedded MIDI IN Jacks)
-              *out_emb_jack_ids # baAssocJackID(1 to n) (IDs of the associated Embedded MIDI OUT Jacks)
+        ep_in_offset = offset + 2
+        pack_into(_ENDPOINT, block, offset,
+                  7,               # bLength (size of the descriptor in bytes)
+                  5,               # bDescriptorType=ENDPOINT
+                  0x80,            # bEndpointAddress (0 to 15 with bit7=1 for IN: 128 to 143, filled in by desc_cfg)
+                  2,               # bmAttributes (2 for Bulk, not shared; alternative: 3 for Interval)
+                  _EP_PACKET_SIZE, # wMaxPacketSize
+                  0                # bInterval (ignored for Bulk - set to 0; alternative: 1 for Interval)
         )
+        offset += 7
+        block[offset:offset + 4 + num_out] = bytes((
+            4 + num_out, # bLength (size of the descriptor in bytes)
+            0x25,        # bDescriptorType=CS_ENDPOINT
+            1,           # bDescriptorSubtype=MS_GENERAL
+            num_out      # bNumEmbMIDIJack (number of Embedded MIDI OUT Jacks)
+        )) + self._out_emb_jack_ids # baAssocJackID(1 to n) (IDs of the associated Embedded MIDI OUT Jacks)
+        return first_str, block, ep_out_offset, ep_in_offset
 
     def num_itfs(self):
         return 2
@@ -253,38 +415,91 @@ class MidiMulti(Interface):
     def _tx_xfer(self):
         '''Keep an active IN transfer to send data to the host, whenever there is data to send'''
         _buffer = self._tx_buffer
-        if self.is_open() and not self.xfer_pending(ep_in := self.ep_in) and _buffer.readable():
-            self.submit_xfer(ep_in, _buffer.pend_read(), self._tx_cb)
+        # self._open is the flag is_open() returns
+        if not self._tx_hold and self._open and not self.xfer_pending(ep_in := self.ep_in) and _buffer.readable():
+            # Can race with _tx_cb submitting; the loser gets a RuntimeError, as the winner's transfer already takes the data
+            try:
+                # Everything queued, in one transfer
+                self.submit_xfer(ep_in, _buffer.pend_read(), self._tx_cb_ref)
+            except RuntimeError:
+                pass
 
     def _tx_cb(self, ep, res, num_bytes):
+        _buffer = self._tx_buffer
         if res == 0:
-            self._tx_buffer.finish_read(num_bytes)
-        self._tx_xfer()
+            _buffer.finish_read(num_bytes)
+        # Submit everything queued while this transfer was in flight as the next one, directly: ep is the IN Endpoint and it doesn't count
+        # as pending while its own callback runs
+        if not self._tx_hold and self._open and _buffer.readable():
+            try:
+                self.submit_xfer(ep, _buffer.pend_read(), self._tx_cb_ref)
+            except RuntimeError:
+                pass # The main thread submitted it first
 
     def _rx_xfer(self):
         '''Keep an active OUT transfer to receive MIDI events from the host'''
         _buffer = self._rx_buffer
-        if self.is_open() and not self.xfer_pending(ep_out := self.ep_out) and _buffer.writable():
-            self.submit_xfer(ep_out, _buffer.pend_write(), self._rx_cb)
+        if self._open and not self.xfer_pending(ep_out := self.ep_out) and _buffer.writable() >= _EP_PACKET_SIZE:
+            # One Bulk packet per transfer: a longer OUT transfer would only complete on a short packet, holding back a full one
+            self.submit_xfer(ep_out, _buffer.pend_write(_EP_PACKET_SIZE), self._rx_cb_ref)
 
     def _rx_cb(self, ep, res, num_bytes):
         '''USB callback function to receive MIDI data'''
         if res == 0:
             self._rx_buffer.finish_write(num_bytes)
-            schedule(self._on_rx, None) # (QUESTION: avoid schedule because it makes it run on the main thread?)
-        self._rx_xfer()
+            if self._direct_in:
+                self._on_rx(None) # Decode and dispatch right away, in the USB callback (this also re-arms the OUT transfer)
+                return
+            # Decoding and the user callback run from the scheduler, draining everything received so far; only schedule it if it isn't
+            # pending yet, so a burst of transfers takes one slot in the schedule queue instead of one per transfer
+            if not self._rx_scheduled:
+                if self._poll_in:
+                    self._rx_scheduled = True # Picked up by the next poll() call, without a round trip through the schedule queue
+                else:
+                    try:
+                        schedule(self._on_rx_ref, None) # (QUESTION: avoid schedule because it makes it run on the main thread?)
+                        self._rx_scheduled = True
+                    except RuntimeError:
+                        # Schedule queue full: decode right away instead (as with direct_in), as the RX buffer may have no room left to
+                        # re-arm the OUT transfer, in which case no next transfer would pick the data up
+                        self._on_rx(None) # This also re-arms the OUT transfer
+                        return
+        self._rx_xfer() # Re-arm the OUT transfer (ep doesn't count as pending while its own callback runs)
 
     def _on_rx(self, _):
-        '''Receive MIDI events; called from self._rx_cb via micropython.schedule'''
+        '''Receive MIDI events; called from self._rx_cb via micropython.schedule, or from poll()'''
+        self._rx_scheduled = False # Cleared first, so data arriving while the callbacks run schedules a new pass
         _buffer = self._rx_buffer
         m = _buffer.pend_read()
-        _callback = self._in_callback
-        i = 0
-        while i <= len(m) - 4:
-            cable = m[i] >> 4
+        if (_callback := self._in_callback) is None:
+            _buffer.finish_read(len(m) & ~(_PACKET_SIZE - 1)) # No callback: discard all complete packets without decoding them
+        elif self._raw_in:
+            n = len(m) & ~(_PACKET_SIZE - 1)
             try:
-                _callback(cable, m[i:i + 4]) # type: ignore
+                _callback(m[:n]) # type: ignore
             except:
                 pass
-            i += 4
-        _buffer.finish_read(i)
\ No newline at end of file
+            _buffer.finish_read(n)
+        else:
+            _buffer.finish_read(_dispatch_packets(m, len(m), self._in_callbacks, self._rx_cable_mask))
+        self._rx_xfer() # Re-arm the OUT transfer in case it stopped because the RX buffer was full
+
+@micropython.viper
+def _dispatch_packets(buf: ptr8, n: int, callbacks, cable_mask: int) -> int:
+    '''Call callbacks[cable](cable, cin, byte_0, byte_1, byte_2) for each complete 4 bytes MIDI Event Packet in buf of which the Cable's bit
+    is set in cable_mask, skipping packets with a reserved CIN (0 or 1, e.g. zero padding); returns the number of bytes processed (viper
+    code, so the packet bytes are read as native integers without creating any objects)'''
+    i = 0
+    while i <= n - _PACKET_SIZE:
+        # One exception handler for the whole batch instead of one per packet; if a callback raises, its packet is skipped and the loop
+        # is entered again for the rest
+        try:
+            while i <= n - _PACKET_SIZE:
+                header = buf[i]
+                cable = header >> 4
+                if header & 0x0E and cable_mask & (1 << cable): # CIN 0 and 1 are reserved and carry no MIDI message
+                    callbacks[cable](cable, header & 0x0F, buf[i + 1], buf[i + 2], buf[i + 3])
+                i += _PACKET_SIZE
+        except:
+            i += _PACKET_SIZE
+    return i
\ No newline at end of file
@@ -10,6 +10,9 @@
     - If usb.device is initiatied with builtin_driver=True this approach doesn’t work with windows (with or without names assigned)
     - If port names are defined, these need to be longer than one character, otherwise Windows draws a GeneralFailure error (this might be
       either a Windows quirk or a bug in machine.USBDevice)
+    - Each port takes its own interface and pair of Bulk Endpoints, where the multiple virtual Cables approach (midi_multi_cable.py) shares
+      a single pair of Endpoints and one RX and TX buffer between all ports - that is the recommended implementation; this one is kept for
+      reference
     
     This library is still in testing phase and further development might introduce breaking changes
 
@@ -35,45 +38,91 @@
     CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
     SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.'''
 
+import micropython
 from micropython import schedule
+from struct import pack_into
 from usb.device.core import Interface, Buffer
 
-_BUFFER_SIZE        = const(16)
 _EP_PACKET_SIZE     = const(64)
+_BUFFER_SIZE        = const(2 * _EP_PACKET_SIZE) # Default room for 2 full-size Bulk packets in each direction (per port, so kept small)
 _ADD_EXTERNAL_JACKS = const(False) # External Jacks are optional
+_PACKET_SIZE        = const(4)    # Size of a USB MIDI Event Packet in bytes
 
-class MidiMulti(Interface):
-    '''Composite USB MIDI 1.0 device class supporting multiple MIDI ports in the form of multiple MIDI Streaming interfaces'''
+# Code Index Number (CIN) per System message (status byte 0xF0 to 0xFF), indexed by the low 4 bits of the status byte; for Channel messages
+# (0x80 to 0xEF) the CIN equals the upper 4 bits of the status byte
+_SYSTEM_CIN = b'\x04\x02\x03\x02\x05\x05\x05\x05\x0F\x0F\x0F\x0F\x0F\x0F\x0F\x0F'
+
+# Status byte per MIDI channel (0 to 15) of the messages sent by the helper functions, looked up instead of combined on each call; channels
+# above 15 raise an IndexError, but -16 to -1 index from the end and wrap around to channels 0 to 15 (so -1 sends on channel 15)
+_NOTE_OFF_STATUS       = bytes(range(0x80, 0x90))
+_NOTE_ON_STATUS        = bytes(range(0x90, 0xA0))
+_CONTROL_CHANGE_STATUS = bytes(range(0xB0, 0xC0))
+
+# Descriptor record formats (packed once per port)
+_MS_HEADER   = '<BBBHH'     # Class-specific MIDI Streaming interface header
+_JACK_IN     = '<BBBBBB'    # MIDI IN Jack
+_JACK_OUT    = '<BBBBBBBBB' # MIDI OUT Jack
+_ENDPOINT    = '<BBBBHB'    # Standard Bulk Endpoint
+_CS_ENDPOINT = '<BBBBB'     # Class-specific MIDI Streaming Bulk Endpoint with one associated Jack
+_INTERFACE   = '<BBBBBBBBB' # Standard interface
 
-    def __init__(self, num_in=1, num_out=1, port_names=None, in_callback=None):
+_ITF_NUM_OFFSET = const(2) # Offset of bInterfaceNumber in the descriptors block of a port, filled in by desc_cfg
+
+class MidiMulti(Interface):
+    '''Composite USB MIDI 1.0 device class supporting multiple MIDI ports in the form of multiple MIDI Streaming interfaces; received MIDI Event
+    Packets are passed as in_callback(port, cin, byte_0, byte_1, byte_2), formerly in_callback(port, packet) (see README.md for the other
+    parameters)'''
+
+    def __init__(self, num_in=1, num_out=1, port_names=None, in_callback=None, poll_in=False, direct_in=False,
+                 tx_buf_size=_BUFFER_SIZE, rx_buf_size=_BUFFER_SIZE):
+        if tx_buf_size < _EP_PACKET_SIZE or rx_buf_size < _EP_PACKET_SIZE:
+            raise ValueError(f'tx_buf_size ({tx_buf_size}) and rx_buf_size ({rx_buf_size}) must be >= {_EP_PACKET_SIZE}')
+        if poll_in and direct_in:
+            raise ValueError('poll_in and direct_in cannot both be True')
         super().__init__()
         self.num_in = num_in
         self.num_out = num_out
         self.num_str_itfs = (num_str_itfs := max(num_in, num_out))
-        port_names = port_names or [None for _ in range(num_str_itfs)]
-        if (n := len(port_names)) > num_str_itfs:
-            del port_names[num_str_itfs - n:]
-        while len(port_names) < num_str_itfs:
-            port_names.append(None)
-        self.port_names = port_names
-        self.ports = [MidiPortInterface(i, i < num_in, i < num_out, num_str_itfs, name, in_callback) \
-                     for i, name in enumerate(self.port_names)]
+        # One name (or None) per port, truncated or padded with None, built in one pass into a new list so the caller's sequence isn't modified
+        num_names = len(port_names) if port_names else 0
+        self.port_names = [port_names[i] if i < num_names else None for i in range(num_str_itfs)]
+        self.ports = [MidiPortInterface(i, i < num_in, i < num_out, num_str_itfs, name, in_callback, poll_in, direct_in, tx_buf_size,
+                                        rx_buf_size) for i, name in enumerate(self.port_names)]
+        # Bound send_event and poll methods per port, created once instead of on each call
+        self._port_send_event = tuple(port.send_event for port in self.ports)
+        self._port_polls = tuple(port.poll for port in self.ports)
 
     # Helper functions for sending common MIDI messages
 
     def note_on(self, port, channel, note, velocity=0x40):
-        self.ports[port].send_event(0x9, 0x90 | channel, note, velocity)
+        return self._port_send_event[port](0x9, _NOTE_ON_STATUS[channel], note, velocity)
 
     def note_off(self, port, channel, note, velocity=0x40):
-        self.ports[port].send_event(0x8, 0x80 | channel, note, velocity)
+        return self._port_send_event[port](0x8, _NOTE_OFF_STATUS[channel], note, velocity)
 
     def control_change(self, port, channel, controller, value):
-        self.ports[port].send_event(0xB, 0xB0 | channel, controller, value)
+        return self._port_send_event[port](0xB, _CONTROL_CHANGE_STATUS[channel], controller, value)
+
+    def send_message(self, port, status, data_1=0, data_2=0):
+        '''Queue a MIDI message of up to 3 bytes to be sent to the host, deriving the CIN from the status byte (System Exclusive needs to be
+        sent with send_event); returns False if failed due to the TX buffer being full'''
+        if status < 0x80:
+            raise ValueError(f'status ({status}) must be a status byte (>= 0x80)')
+        return self._port_send_event[port](status >> 4 if status < 0xF0 else _SYSTEM_CIN[status & 0x0F], status, data_1, data_2)
 
     def send_event(self, port, cin, data_0, data_1=0, data_2=0):
         '''Queue a MIDI Event Packet to be sent to the host; takes a port number, a USB-MIDI Code Index Number (CIN) and up to three MIDI data
         bytes; returns False if failed due to the TX buffer being full'''
-        return self.ports[port].send_event(cin, data_0, data_1, data_2)
+        return self._port_send_event[port](cin, data_0, data_1, data_2)
+
+    def poll(self):
+        '''Process the MIDI data received on all ports since the previous call; only needed (and to be called from the main loop) if poll_in
+        is True, instead of the callback being called via micropython.schedule; returns True if anything was received'''
+        received = False
+        for _poll in self._port_polls:
+            if _poll():
+                received = True
+        return received
 
     def desc_cfg(self, desc, itf_num, ep_num, strs):
         # Interface Association Descriptor
@@ -94,17 +143,18 @@ class MidiMulti(Interface):
             iInterface         = 0        # Index of string descriptor or 0 if none assigned
         )
         # Class-specific Audio Control header, points to all MIDI Streaming interfaces following
-        bLength = 8 + (num_str_itfs := self.num_str_itfs)
+        num_str_itfs = self.num_str_itfs
+        bLength = 8 + num_str_itfs
         wTotalLength = 8 + num_str_itfs
-        baInterfaceNr = list(range(itf_num + 1, itf_num + 1 + num_str_itfs))
-        desc.pack('<BBBHHB' + 'B' * num_str_itfs, 
-                  bLength,       # bLength (size of the descriptor in bytes)
-                  0x24,          # bDescriptorType=CS_INTERFACE
-                  1,             # bDescriptorSubType=MS_HEADER
-                  0x0100,        # bcdADC (USB MIDI 1.0 specs)
-                  wTotalLength,  # wTotalLength (total size of class specific descriptors)
-                  num_str_itfs,     # bInCollection (number of streaming interfaces)
-                  *baInterfaceNr # baInterfaceNr(1 to n) (assign MIDIStreaming interfaces 1 to n)
+        baInterfaceNr = bytes(range(itf_num + 1, itf_num + 1 + num_str_itfs)) # Packed as one field
+        desc.pack(f'<BBBHHB{num_str_itfs}s',
+                  bLength,      # bLength (size of the descriptor in bytes)
+                  0x24,         # bDescriptorType=CS_INTERFACE
+                  1,            # bDescriptorSubType=MS_HEADER
+                  0x0100,       # bcdADC (USB MIDI 1.0 specs)
+                  wTotalLength, # wTotalLength (total size of class specific descriptors)
+                  num_str_itfs, # bInCollection (number of streaming interfaces)
+                  baInterfaceNr # baInterfaceNr(1 to n) (assign MIDIStreaming interfaces 1 to n)
         )
         itf_num += 1
         for i, port in enumerate(self.ports):
@@ -125,149 +175,191 @@ class MidiMulti(Interface):
 class MidiPortInterface(Interface):
     '''Class providing one MIDIStreaming interface for one port'''
 
-    def __init__(self, port_index, add_in, add_out, num_str_itfs, port_name=None, in_callback=None):
+    def __init__(self, port_index, add_in, add_out, num_str_itfs, port_name=None, in_callback=None, poll_in=False, direct_in=False,
+                 tx_buf_size=_BUFFER_SIZE, rx_buf_size=_BUFFER_SIZE):
         super().__init__()
         self.port_index = port_index
         self.add_in = add_in
         self.add_out = add_out
         self.num_str_itfs = num_str_itfs
         self.port_name = port_name
-        self._in_callback = None
+        self._in_callback = in_callback
+        self._poll_in = poll_in
+        self._direct_in = direct_in
+        self._desc_block = None # (index of port name string, descriptors block, Endpoint address offsets), see desc_cfg
         self.ep_out = None
         self.ep_in = None
-        self._rx_buffer = Buffer(_BUFFER_SIZE)
-        self._tx_buffer = Buffer(_BUFFER_SIZE)
+        self._rx_buffer = Buffer(rx_buf_size)
+        self._tx_buffer = Buffer(tx_buf_size)
+        # Bound once, not per transfer
+        self._tx_cb_ref = self._tx_cb
+        self._rx_cb_ref = self._rx_cb
+        self._on_rx_ref = self._on_rx
+        self._rx_scheduled = False
 
     def send_event(self, cin, data_0, data_1=0, data_2=0):
         '''Queue a MIDI Event Packet to be sent to the host on this port; takes a USB-MIDI Code Index Number (CIN) and up to three MIDI data
         bytes; returns False if failed due to the TX buffer being full'''
-        _buffer = self._tx_buffer
-        w = _buffer.pend_write()
-        if len(w) < 4:
+        # Write the MIDI Event Packet straight into the TX buffer (no intermediate tuple, bytes object or memoryview); Cable Number is always 0
+        if not self._tx_buffer.write_4(cin, data_0, data_1, data_2):
             return False # TX buffer full
-        w[:4] = bytes((cin, data_0, data_1, data_2))
-        _buffer.finish_write(4)
         self._tx_xfer()
         return True
 
+    def poll(self):
+        '''Process the MIDI data received on this port since the previous call, if poll_in is True; returns True if anything was received'''
+        if self._rx_scheduled:
+            self._on_rx(None)
+            return True
+        return False
+
     def desc_cfg(self, desc, ms_if_num, ep_num, strs):
-        in_emb_jack_id = 1 + (4 if _ADD_EXTERNAL_JACKS else 2) * (port := self.port_index)
+        # The descriptors of this port only depend on the configuration and on the index of the port name string, so they are built once as
+        # one block and reused on re-initialisation (when only sizing the descriptor, any cached block will do); only the interface number
+        # and Endpoint addresses are filled in on each call
+        if (desc_block := self._desc_block) is None or (desc.b is not None and desc_block[0] != len(strs)):
+            self._desc_block = (desc_block := self._build_desc_block(strs))
+        elif (name := self.port_name) is not None:
+            strs.append(name)
+        block = desc_block[1]
+        block[_ITF_NUM_OFFSET] = ms_if_num
+        if self.add_in:
+            self.ep_out = ep_num
+            block[desc_block[2]] = ep_num
+        if self.add_out:
+            self.ep_in = (ep_in := ep_num | 0x80)
+            block[desc_block[3]] = ep_in
+        desc.extend(block)
+
+    def _build_desc_block(self, strs):
+        '''Build the MIDI Streaming interface, Jack and Endpoint descriptors of this port as one block and add the port name to strs; returns
+        (index of port name string, block, offset of OUT Endpoint address, offset of IN Endpoint address), with the interface number and
+        Endpoint addresses to be filled in by desc_cfg'''
+        first_str = len(strs)
+        add_in = self.add_in
+        add_out = self.add_out
+        in_emb_jack_id = 1 + (4 if _ADD_EXTERNAL_JACKS else 2) * self.port_index
         in_ext_jack_id = in_emb_jack_id + 1
         out_emb_jack_id = (in_ext_jack_id if _ADD_EXTERNAL_JACKS else in_emb_jack_id) + 1
         out_ext_jack_id = out_emb_jack_id + 1
+        in_jack_id = in_ext_jack_id if _ADD_EXTERNAL_JACKS else in_emb_jack_id
+        # The descriptors are packed into a single block, which is copied into the descriptor in one go by desc_cfg
+        wTotalLength = 7 + 2 * (6 + 9) if _ADD_EXTERNAL_JACKS else 7 + 6 + 9
+        block = bytearray(9 + wTotalLength + (add_in + add_out) * (7 + 5))
         # MIDI Streaming interface
-        num_endpoints = (add_in := self.add_in) + (add_out := self.add_out)
-        desc.interface(ms_if_num,     # bInterfaceNumber (unique ID)
-                       num_endpoints, # bNumEndpoints (number of MIDI endpoints assigned to this MIDI Streaming interface)
-                       1,             # bInterfaceClass=AUDIO
-                       3,             # bInterfaceSubClass=MIDISTREAMING
-                       0,             # bInterfaceProtocol (unused)
-                       0              # iInterface (index of string descriptor or 0 if none assigned)
-                       )
-        desc.interface(
-            bInterfaceNumber   = ms_if_num,     # Unique ID
-            bNumEndpoints      = num_endpoints, # Number of MIDI endpoints assigned to this MIDI Streaming interface
-            bInterfaceClass    = 1,             # AUDIO
-            bInterfaceSubClass = 3,             # MIDISTREAMING
-            bInterfaceProtocol = 0,             # Unused
-            iInterface         = 0              # Index of string descriptor or 0 if none assigned
+        pack_into(_INTERFACE, block, 0,
+                  9,                # bLength (size of the descriptor in bytes)
+                  4,                # bDescriptorType=INTERFACE
+                  0,                # bInterfaceNumber (unique ID, filled in by desc_cfg)
+                  0,                # bAlternateSetting
+                  add_in + add_out, # bNumEndpoints (number of MIDI endpoints assigned to this MIDI Streaming interface)
+                  1,                # bInterfaceClass=AUDIO
+                  3,                # bInterfaceSubClass=MIDISTREAMING
+                  0,                # bInterfaceProtocol (unused)
+                  0                 # iInterface (index of string descriptor or 0 if none assigned)
         )
-        _pack = desc.pack
         # Class-specific MIDI Streaming header
-        wTotalLength = 7 + 2 * (6 + 9) if _ADD_EXTERNAL_JACKS else 7 + 6 + 9
-        _pack('<BBBHH',
-              7,           # bLength (size of the descriptor in bytes)
-              0x24,        # bDescriptorType=CS_INTERFACE
-              1,           # bDescriptorSubType=MS_HEADER
-              0x0100,      # bcdADC (USB MIDI 1.0 specs)
-              wTotalLength # wTotalLength (total size of class specific descriptors)
+        pack_into(_MS_HEADER, block, 9,
+                  7,           # bLength (size of the descriptor in bytes)
+                  0x24,        # bDescriptorType=CS_INTERFACE
+                  1,           # bDescriptorSubType=MS_HEADER
+                  0x0100,      # bcdADC (USB MIDI 1.0 specs)
+                  wTotalLength # wTotalLength (total size of class specific descriptors)
         )
+        offset = 9 + 7
         # Embedded IN Jack (required - create dummy if no IN port is to be exposed)
         if (name := self.port_name) is None:
             iJack = 0
         else:
             iJack = len(strs)
             strs.append(name)
-        _pack('<BBBBBB',
-              6,              # bLength (size of the descriptor in bytes)
-              0x24,           # bDescriptorType=CS_INTERFACE
-              2,              # bDescriptorSubType=MIDI_IN_JACK
-              1,              # bJackType=EMBEDDED
-              in_emb_jack_id, # bJackID (unique ID)
-              iJack           # iJack (index of string descriptor or 0 if none assigned)
-        )
-        # External IN Jack (create dummy if no IN port is to be exposed)
-        if _ADD_EXTERNAL_JACKS:
-            _pack('<BBBBBB',
+        pack_into(_JACK_IN, block, offset,
                   6,              # bLength (size of the descriptor in bytes)
                   0x24,           # bDescriptorType=CS_INTERFACE
                   2,              # bDescriptorSubType=MIDI_IN_JACK
-                  2,              # bJackType=EXTERNAL
-                  in_ext_jack_id, # bJackID (unique ID)
-                  0               # iJack (index of string descriptor or 0 if none assigned)
-            )
-        # Embedded OUT Jack (required - create dummy if no OUT port is to be exposed)
-        in_jack_id = in_ext_jack_id if _ADD_EXTERNAL_JACKS else in_emb_jack_id
-        _pack('<BBBBBBBBB',
-              9,               # bLength (size of the descriptor in bytes)
-              0x24,            # bDescriptorType=CS_INTERFACE
-              3,               # bDescriptorSubType=MIDI_OUT_JACK
-              1,               # bJackType=EMBEDDED
-              out_emb_jack_id, # bJackID (unique ID)
-              1,               # bNrInputPins (number of input Pins on this MIDI OUT Jack)
-              in_jack_id,      # baSourceID(1) (ID of the Entity to which the first Pin is connected)
-              1,               # baSourcePIN(1) (output Pin number for the Entity to which the first Pin is connected)
-              iJack           # iJack (index of string descriptor or 0 if none assigned)
+                  1,              # bJackType=EMBEDDED
+                  in_emb_jack_id, # bJackID (unique ID)
+                  iJack           # iJack (index of string descriptor or 0 if none assigned)
         )
-        # External OUT Jack (create dummy if no IN port is to be exposed)
+        offset += 6
+        # External IN Jack (create dummy if no IN port is to be exposed)
         if _ADD_EXTERNAL_JACKS:
-            _pack('<BBBBBBBBB',
+            pack_into(_JACK_IN, block, offset,
+                      6,              # bLength (size of the descriptor in bytes)
+                      0x24,           # bDescriptorType=CS_INTERFACE
+                      2,              # bDescriptorSubType=MIDI_IN_JACK
+                      2,              # bJackType=EXTERNAL
+                      in_ext_jack_id, # bJackID (unique ID)
+                      0               # iJack (index of string descriptor or 0 if none assigned)
+            )
+            offset += 6
+        # Embedded OUT Jack (required - create dummy if no OUT port is to be exposed)
+        pack_into(_JACK_OUT, block, offset,
                   9,               # bLength (size of the descriptor in bytes)
                   0x24,            # bDescriptorType=CS_INTERFACE
                   3,               # bDescriptorSubType=MIDI_OUT_JACK
-                  2,               # bJackType=EXTERNAL
-                  out_ext_jack_id, # bJackID (unique ID)
+                  1,               # bJackType=EMBEDDED
+                  out_emb_jack_id, # bJackID (unique ID)
                   1,               # bNrInputPins (number of input Pins on this MIDI OUT Jack)
-                  in_emb_jack_id,  # baSourceID(1) (ID of the Entity to which the first Pin is connected)
+                  in_jack_id,      # baSourceID(1) (ID of the Entity to which the first Pin is connected)
                   1,               # baSourcePIN(1) (output Pin number for the Entity to which the first Pin is connected)
-                  0               # iJack (index of string descriptor or 0 if none assigned)
+                  iJack            # iJack (index of string descriptor or 0 if none assigned)
+        )
+        offset += 9
+        # External OUT Jack (create dummy if no IN port is to be exposed)
+        if _ADD_EXTERNAL_JACKS:
+            pack_into(_JACK_OUT, block, offset,
+                      9,               # bLength (size of the descriptor in bytes)
+                      0x24,            # bDescriptorType=CS_INTERFACE
+                      3,               # bDescriptorSubType=MIDI_OUT_JACK
+                      2,               # bJackType=EXTERNAL
+                      out_ext_jack_id, # bJackID (unique ID)
+                      1,               # bNrInputPins (number of input Pins on this MIDI OUT Jack)
+                      in_emb_jack_id,  # baSourceID(1) (ID of the Entity to which the first Pin is connected)
+                      1,               # baSourcePIN(1) (output Pin number for the Entity to which the first Pin is connected)
+                      0                # iJack (index of string descriptor or 0 if none assigned)
             )
+            offset += 9
         # OUT Endpoint
+        ep_out_offset = None
         if add_in:
-            self.ep_out = ep_num
-            _pack('<BBBBHB',
-                7,               # bLength (size of the descriptor in bytes)
-                5,               # bDescriptorType=ENDPOINT
-                ep_num,          # bEndpointAddress (0 to 15 with bit7=0 for OUT)
-                2,               # bmAttributes (2 for Bulk, not shared; alternative: 3 for Interval)
-                _EP_PACKET_SIZE, # wMaxPacketSize
-                0                # bInterval (ignored for Bulk - set to 0; alternative: 1 for Interval)
+            ep_out_offset = offset + 2
+            pack_into(_ENDPOINT, block, offset,
+                      7,               # bLength (size of the descriptor in bytes)
+                      5,               # bDescriptorType=ENDPOINT
+                      0,               # bEndpointAddress (0 to 15 with bit7=0 for OUT, filled in by desc_cfg)
+                      2,               # bmAttributes (2 for Bulk, not shared; alternative: 3 for Interval)
+                      _EP_PACKET_SIZE, # wMaxPacketSize
+                      0                # bInterval (ignored for Bulk - set to 0; alternative: 1 for Interval)
             )
-            _pack('<BBBBB',
-                5,             # bLength (size of the descriptor in bytes)
-                0x25,          # bDescriptorType=CS_ENDPOINT
-                1,             # bDescriptorSubtype=MS_GENERAL
-                1,             # bNumEmbMIDIJack (number of Embedded MIDI IN Jacks)
-                in_emb_jack_id # baAssocJackID(1) (ID of the first associated Embedded MIDI IN Jack)
+            pack_into(_CS_ENDPOINT, block, offset + 7,
+                      5,             # bLength (size of the descriptor in bytes)
+                      0x25,          # bDescriptorType=CS_ENDPOINT
+                      1,             # bDescriptorSubtype=MS_GENERAL
+                      1,             # bNumEmbMIDIJack (number of Embedded MIDI IN Jacks)
+                      in_emb_jack_id # baAssocJackID(1) (ID of the first associated Embedded MIDI IN Jack)
             )
+            offset += 7 + 5
         # IN Endpoint
+        ep_in_offset = None
         if add_out:
-            self.ep_in = (ep_in := ep_num | 0x80)
-            _pack('<BBBBHB',
-                7,               # bLength (size of the descriptor in bytes)
-                5,               # bDescriptorType=ENDPOINT
-                ep_in,           # bEndpointAddress (0 to 15 with bit7=1 for IN: 128 to 143)
-                2,               # bmAttributes (2 for Bulk, not shared; alternative: 3 for Interval)
-                _EP_PACKET_SIZE, # wMaxPacketSize
-                0                # bInterval (ignored for Bulk - set to 0; alternative: 1 for Interval)
+            ep_in_offset = offset + 2
+            pack_into(_ENDPOINT, block, offset,
+                      7,               # bLength (size of the descriptor in bytes)
+                      5,               # bDescriptorType=ENDPOINT
+                      0x80,            # bEndpointAddress (0 to 15 with bit7=1 for IN: 128 to 143, filled in by desc_cfg)
+                      2,               # bmAttributes (2 for Bulk, not shared; alternative: 3 for Interval)
+                      _EP_PACKET_SIZE, # wMaxPacketSize
+                      0                # bInterval (ignored for Bulk - set to 0; alternative: 1 for Interval)
             )
-            _pack('<BBBBB',
-                5,              # bLength (size of the descriptor in bytes)
-                0x25,           # bDescriptorType=CS_ENDPOINT
-                1,              # bDescriptorSubtype=MS_GENERAL
-                1,              # bNumEmbMIDIJack (number of Embedded MIDI IN Jacks)
-                out_emb_jack_id # baAssocJackID(1) (ID of the first associated Embedded MIDI OUT Jack)
+            pack_into(_CS_ENDPOINT, block, offset + 7,
+                      5,              # bLength (size of the descriptor in bytes)
+                      0x25,           # bDescriptorType=CS_ENDPOINT
+                      1,              # bDescriptorSubtype=MS_GENERAL
+                      1,              # bNumEmbMIDIJack (number of Embedded MIDI IN Jacks)
+                      out_emb_jack_id # baAssocJackID(1) (ID of the first associated Embedded MIDI OUT Jack)
             )
+        return first_str, block, ep_out_offset, ep_in_offset
 
     def on_open(self):
         super().on_open()
@@ -278,38 +370,85 @@ class MidiPortInterface(Interface):
     def _tx_xfer(self):
         '''Keep an active IN transfer to send data to the host, whenever there is data to send'''
         _buffer = self._tx_buffer
-        if (ep_in := self.ep_in) is not None and self.is_open() and not self.xfer_pending(ep_in) and _buffer.readable():
-            self.submit_xfer(ep_in, _buffer.pend_read(), self._tx_cb)
+        # self._open is the flag is_open() returns
+        if (ep_in := self.ep_in) is not None and self._open and not self.xfer_pending(ep_in) and _buffer.readable():
+            # Can race with _tx_cb submitting; the loser gets a RuntimeError, as the winner's transfer already takes the data
+            try:
+                # Everything queued, in one transfer
+                self.submit_xfer(ep_in, _buffer.pend_read(), self._tx_cb_ref)
+            except RuntimeError:
+                pass
 
     def _tx_cb(self, ep, res, num_bytes):
+        _buffer = self._tx_buffer
         if res == 0:
-            self._tx_buffer.finish_read(num_bytes)
-        self._tx_xfer()
+            _buffer.finish_read(num_bytes)
+        # Submit everything queued while this transfer was in flight as the next one, directly: ep is the IN Endpoint and it doesn't count
+        # as pending while its own callback runs
+        if self._open and _buffer.readable():
+            try:
+                self.submit_xfer(ep, _buffer.pend_read(), self._tx_cb_ref)
+            except RuntimeError:
+                pass # The main thread submitted it first
 
     def _rx_xfer(self):
         '''Keep an active OUT transfer to receive MIDI events from the host'''
         _buffer = self._rx_buffer
-        if (ep_out := self.ep_out) is not None and self.is_open() and not self.xfer_pending(ep_out) and _buffer.writable():
-            self.submit_xfer(ep_out, _buffer.pend_write(), self._rx_cb)
+        if (ep_out := self.ep_out) is not None and self._open and not self.xfer_pending(ep_out) and _buffer.writable() >= _EP_PACKET_SIZE:
+            # One Bulk packet per transfer: a longer OUT transfer would only complete on a short packet, holding back a full one
+            self.submit_xfer(ep_out, _buffer.pend_write(_EP_PACKET_SIZE), self._rx_cb_ref)
 
     def _rx_cb(self, ep, res, num_bytes):
         '''USB callback function to receive MIDI data'''
         if res == 0:
             self._rx_buffer.finish_write(num_bytes)
-            schedule(self._on_rx, None) # (QUESTION: avoid schedule because it makes it run on the main thread?)
+            if self._direct_in:
+                self._on_rx(None) # Decode and dispatch right away, in the USB callback (this also re-arms the OUT transfer)
+                return
+            # Decoding and the user callback run from the scheduler, draining everything received so far; only schedule it if it isn't
+            # pending yet, so a burst of transfers takes one slot in the schedule queue instead of one per transfer
+            if not self._rx_scheduled:
+                if self._poll_in:
+                    self._rx_scheduled = True # Picked up by the next poll() call, without a round trip through the schedule queue
+                else:
+                    try:
+                        schedule(self._on_rx_ref, None) # (QUESTION: avoid schedule because it makes it run on the main thread?)
+                        self._rx_scheduled = True
+                    except RuntimeError:
+                        # Schedule queue full: decode right away instead (as with direct_in), as the RX buffer may have no room left to
+                        # re-arm the OUT transfer, in which case no next transfer would pick the data up
+                        self._on_rx(None) # This also re-arms the OUT transfer
+                        return
         self._rx_xfer()
 
     def _on_rx(self, _):
-        '''Receive MIDI events; called from self._rx_cb via micropython.schedule'''
+        '''Receive MIDI events; called from self._rx_cb via micropython.schedule, or from poll()'''
+        self._rx_scheduled = False # Cleared first, so data arriving while the callback runs schedules a new pass
         port = self.port_index
         _buffer = self._rx_buffer
         m = _buffer.pend_read()
-        _callback = self._in_callback
-        i = 0
-        while i <= len(m) - 4:
-            try:
-                _callback(port, m[i:i + 4]) # type: ignore
-            except:
-                pass
-            i += 4
-        _buffer.finish_read(i)
\ No newline at end of file
+        n = len(m)
+        if (_callback := self._in_callback) is None:
+            _buffer.finish_read(n & ~(_PACKET_SIZE - 1)) # No callback: discard all complete packets without decoding them
+        else:
+            _buffer.finish_read(_dispatch_packets(m, n, _callback, port))
+        self._rx_xfer() # Re-arm the OUT transfer in case it stopped because the RX buffer was full
+
+@micropython.viper
+def _dispatch_packets(buf: ptr8, n: int, callback, port: int) -> int:
+    '''Call callback(port, cin, byte_0, byte_1, byte_2) for each complete 4 bytes MIDI Event Packet in buf, skipping packets with a reserved
+    CIN (0 or 1, e.g. zero padding); returns the number of bytes processed (viper code, so the packet bytes are read as native integers
+    without creating any objects)'''
+    i = 0
+    while i <= n - _PACKET_SIZE:
+        # One exception handler for the whole batch instead of one per packet; if the callback raises, its packet is skipped and the loop
+        # is entered again for the rest
+        try:
+            while i <= n - _PACKET_SIZE:
+                cin = buf[i] & 0x0F
+                if cin > 1: # CIN 0 and 1 are reserved and carry no MIDI message
+                    callback(port, cin, buf[i + 1], buf[i + 2], buf[i + 3])
+                i += _PACKET_SIZE
+        except:
+            i += _PACKET_SIZE
+    return i
\ No newline at end of file